@@ -2,11 +2,13 @@
 PIN diode attenuator class and calibration methods
 """
 import logging
-import scipy
-import dill as pickle
+import time
 
 from Electronics.Interfaces.LabJack import LJTickDAC
 from Electronics.Instruments import Attenuator
+from Electronics.Instruments.PINatten.cache import FileCache
+from Electronics.Instruments.PINatten.calfile import (load_calibration,
+                                                     SplineTable)
 
 module_logger = logging.getLogger(__name__)
 
@@ -49,7 +51,9 @@ class PINattenuator(Attenuator):
   @ivar atten_table : control voltage indexed by attenuation
   """
   def __init__(self, parent, name, voltage_source, ctlV_spline,
-               min_gain, max_gain):
+               min_gain, max_gain, calfile=None, chanID=None,
+               surface=None, freq=None, power_meter=None, ref_power=None,
+               drift=None, catalog=None, serial=None):
     """
     @param parent : the object which instantiated this class
     @type  parent : object
@@ -60,26 +64,147 @@ class PINattenuator(Attenuator):
     @param voltage_source : voltage source controlling this attenuator
     @type  voltage_source : VoltageSource instance
     
-    @param ctlV_spline : spline to convert gain to control voltage
-    @type  ctlV_spline : scipy.interpolate.interp1d instance
+    @param ctlV_spline : spline to convert gain to control voltage, or model
+    @type  ctlV_spline : calfile.PiecewiseCubic, interp1d or
+                         model.AttenuatorModel instance
     
     @param min_gain : minimum gain of the attenuator
     @type  min_gain : float
+
+    @param max_gain : maximum gain of the attenuator
+    @type  max_gain : float
+
+    If 'ctlV_spline' is an AttenuatorModel, its inverse is used to get the
+    control voltage.  'min_gain' and 'max_gain' may be None, in which case
+    the gain range of the model, or of the spline's breakpoints, is used.
     
-    
+    @param calfile : calibration file to use instead of ctlV_spline
+    @type  calfile : str
+
+    @param chanID : channel in calfile, e.g. 'R1-18-E'
+    @type  chanID : str
+
+    @param surface : frequency-dependent calibration
+    @type  surface : surface.CalibrationSurface instance
+
+    @param freq : frequency (GHz) at which the attenuator is used
+    @type  freq : float
+
+    If 'surface' is given, the other calibration arguments may be None; the
+    model for 'freq' is used and set_freq() selects another frequency.
+
+    If 'calfile' is given, 'ctlV_spline' may be None.  The spline is then
+    taken from the shared calibration cache each time it is used, so all
+    attenuators share one copy and a changed file is picked up automatically.
+
+    @param power_meter : power meter after the attenuator, for set_atten_closed_loop()
+    @type  power_meter : PowerMeter instance
+
+    @param ref_power : power (dBm) at the meter for zero gain; see measure_reference()
+    @type  ref_power : float
+
+    @param drift : tracker which corrects the calibration from power readings;
+                   see record_reading()
+    @type  drift : drift.DriftTracker instance
+
+    @param catalog : calibrations to choose from
+    @type  catalog : catalog.CalibrationCatalog instance
+
+    @param serial : board serial number and A or B, e.g. '3A'
+    @type  serial : str
+
+    If 'catalog' is given and 'calfile' is not, 'calfile' and 'chanID' are
+    those of the latest valid calibration for 'serial' or, if 'serial' is
+    None, for the slot 'chanID'.
     """
+    if catalog is not None and calfile is None:
+      calfile, chanID = catalog.resolve(serial=serial, slot=chanID)
     self.name = name
+    self.serial = serial
     self.VS = voltage_source
-    self.spline = ctlV_spline
+    self.calfile = calfile
+    self.chanID = chanID
+    self._spline = ctlV_spline
+    if min_gain is None or max_gain is None:
+      gain_range, volts_range = self._calibrated_ranges()
+      if gain_range is not None:
+        if min_gain is None:
+          min_gain = gain_range[0]
+        if max_gain is None:
+          max_gain = gain_range[1]
     self.min_gain = min_gain
     self.max_gain = max_gain
-    self.max_atten = self.max_gain - self.min_gain
+    if max_gain is not None and min_gain is not None:
+      self.max_atten = self.max_gain - self.min_gain
+    else:
+      self.max_atten = None
     mylogger = logging.getLogger(module_logger.name+".PINattenuator")
     mylogger.debug(" Initializing %s with voltage source %s",
                    self, self.VS)
     Attenuator.__init__(self, parent=parent, name=self.name)
     self.atten = None
     self.logger = mylogger
+    self.PM = power_meter
+    self.ref_power = ref_power
+    self.drift = drift
+    self._cal_gain = None
+    self.surface = surface
+    self.freq = None
+    if surface is not None and freq is not None:
+      self.set_freq(freq)
+
+  def set_freq(self, freq):
+    """
+    Use the calibration for the frequency to which the receiver is tuned
+
+    This takes the model for 'freq' from the calibration surface and updates
+    the gain limits.  The attenuation must be set again afterwards.
+
+    @param freq : frequency in GHz
+    @type  freq : float
+    """
+    model = self.surface.model(freq)
+    self.freq = freq
+    self._spline = model
+    self.min_gain, self.max_gain = model.gain_range
+    self.max_atten = self.max_gain - self.min_gain
+    self.logger.debug("set_freq: %s GHz; maximum attenuation %f dB",
+                      freq, self.max_atten)
+
+  @property
+  def spline(self):
+    """
+    Spline to convert gain to control voltage
+    """
+    if self.calfile:
+      (att_spline, V_range), (ctlV_spline, att_range) = get_splines(self.calfile)
+      return ctlV_spline[self.chanID]
+    return self._spline
+
+  @spline.setter
+  def spline(self, ctlV_spline):
+    self._spline = ctlV_spline
+
+  def _calibrated_ranges(self):
+    """
+    Ranges of gain and control voltage covered by the calibration
+
+    These are the ranges of a model or, for a control voltage spline, of its
+    breakpoints and their values.
+
+    @return: (lowest, highest) gain and (lowest, highest) control voltage, or
+      None for each if there is no calibration
+    """
+    spline = self.spline
+    # an InverseTable gives the 'inverse' method of the model
+    model = getattr(spline, "__self__", spline)
+    if hasattr(model, "gain_range"):
+      return model.gain_range, model.volts_range
+    if hasattr(spline, "x") and hasattr(spline, "y"):
+      gains, volts = spline.x, spline.y
+      return ((float(min(gains)), float(max(gains))),
+              (float(min(volts)), float(max(volts))))
+    return None, None
     
   def get_atten(self):
     """
@@ -99,6 +224,10 @@ class PINattenuator(Attenuator):
     if atten < 0.0:
       self.logger.error("set_atten: attenuation can not be negative")
       return False
+    if self.max_atten is None:
+      self.logger.error("set_atten: gain limits are not known;"
+                        " give them or call set_freq()")
+      return False
     if atten > self.max_atten:
       self.logger.error("set_atten: maximum attenuation is %f", self.max_atten)
       return False
@@ -107,21 +236,208 @@ class PINattenuator(Attenuator):
       requested = self.max_gain + gain
       self.logger.debug("set_atten: %f dB attenuation is %f dB gain",
                         atten, requested)
-      ctl_volts = self.spline(requested)
+      ctl_volts = self._ctl_volts(requested)
       self.logger.debug("set_atten: requires %f volts", ctl_volts)
       status = self.VS.setVoltage(ctl_volts)
       if status:
         self.atten = atten
       return status
-  
+
+  def _ctl_volts(self, gain, correct=True):
+    """
+    Control voltage for a gain, from the model or spline
+
+    If there is a drift tracker the gain is first corrected for drift.  The
+    calibrated gain which was used is kept for record_reading().
+    """
+    if correct and self.drift is not None:
+      gain = min(max(float(self.drift.request(gain)), self.min_gain),
+                 self.max_gain)
+    self._cal_gain = gain
+    spline = self.spline
+    if hasattr(spline, "inverse"):
+      return float(spline.inverse(gain))
+    return float(spline(gain))
+
+  def _gain_slope(self, volts, gain):
+    """
+    Calibration slope d(gain)/d(volts) near the given point
+    """
+    spline = self.spline
+    if hasattr(spline, "inverse"):
+      return float(spline.derivative(volts))
+    # control voltage spline; differentiate it numerically inside its range
+    step = 0.05
+    low = max(gain - step, self.min_gain)
+    high = min(gain + step, self.max_gain)
+    dV = float(spline(high)) - float(spline(low))
+    if dV == 0:
+      return 0.
+    return (high - low)/dV
+
+  def measure_reference(self):
+    """
+    Measure 'ref_power' with the attenuator at minimum attenuation
+
+    'ref_power' is the power the meter would read for zero gain, so the
+    power expected for a gain g is ref_power + g.
+    """
+    self.VS.setVoltage(self._ctl_volts(self.max_gain, correct=False))
+    self.ref_power = float(self.PM.power()) - self.max_gain
+    self.logger.debug("measure_reference: reference power is %f dBm",
+                      self.ref_power)
+    return self.ref_power
+
+  def record_reading(self, power=None):
+    """
+    Use a power reading at the present setting to track calibration drift
+
+    The attenuation must have been set with set_atten() or, with a model,
+    set_atten_closed_loop(), and 'ref_power' must be known.  A warning is logged when the tracker advises recalibration.
+
+    @param power : power (dBm) after the attenuator; default: read the meter
+    @type  power : float
+
+    @return: drift statistics (dict), or None if drift is not being tracked
+    """
+    if self.drift is None or self._cal_gain is None:
+      return None
+    if power is None:
+      power = float(self.PM.power())
+    self.drift.update(self._cal_gain, power - self.ref_power)
+    stats = self.drift.statistics()
+    if stats["recalibrate"]:
+      self.logger.warning("record_reading: %s drift %f dB, scatter %f dB;"
+                          " recalibrate", self.name, stats["drift"],
+                          stats["residual_rms"])
+    return stats
+
+  def set_atten_closed_loop(self, atten, tolerance=0.05, max_iter=3,
+                            budget=None):
+    """
+    Set the attenuation using the power meter to correct the calibration
+
+    The control voltage from the calibration is set and the power read.  The
+    voltage is then corrected with a Newton step using the calibration slope,
+    or a secant step once two readings are available, until the measured
+    attenuation is within 'tolerance', 'max_iter' readings have been taken or
+    another step would exceed the time 'budget'.
+
+    'ref_power' must be known; see measure_reference().
+
+    @param atten : attenuation in dB
+    @type  atten : float
+
+    @param tolerance : acceptable attenuation error in dB
+    @type  tolerance : float
+
+    @param max_iter : maximum number of power readings
+    @type  max_iter : int
+
+    @param budget : maximum time in seconds; None for no limit
+    @type  budget : float
+
+    @return: dict with 'atten' (measured), 'error' (dB), 'volts',
+      'iterations', 'elapsed' (s) and 'converged' (bool), or False if
+      'atten' is out of range or 'ref_power' is not known
+    """
+    if self.max_atten is None:
+      self.logger.error("set_atten_closed_loop: gain limits are not known;"
+                        " give them or call set_freq()")
+      return False
+    if atten < 0.0 or atten > self.max_atten:
+      self.logger.error("set_atten_closed_loop: attenuation must be 0-%f",
+                        self.max_atten)
+      return False
+    if self.ref_power is None:
+      self.logger.error("set_atten_closed_loop: no reference power;"
+                        " call measure_reference() first")
+      return False
+    start = time.time()
+    target_gain = self.max_gain - atten
+    target = self.ref_power + target_gain
+    volts = self._ctl_volts(target_gain)
+    gain_range, vlimits = self._calibrated_ranges()
+    history = []
+    iteration_time = 0.
+    while True:
+      step_start = time.time()
+      self.VS.setVoltage(volts)
+      power = float(self.PM.power())
+      history.append((volts, power))
+      if len(history) == 1 and self.drift is not None:
+        # only the first voltage comes from the calibration
+        self.drift.update(self._cal_gain, power - self.ref_power)
+      error = power - target
+      iteration_time = max(iteration_time, time.time() - step_start)
+      elapsed = time.time() - start
+      self.logger.debug("set_atten_closed_loop: %f V gives %f dBm; error %f dB",
+                        volts, power, error)
+      if abs(error) <= tolerance or len(history) >= max_iter:
+        break
+      if budget is not None and elapsed + iteration_time > budget:
+        break
+      if len(history) > 1 and history[-1][0] != history[-2][0]:
+        slope = (history[-1][1] - history[-2][1])/ \
+                (history[-1][0] - history[-2][0])
+      else:
+        slope = self._gain_slope(volts, target_gain)
+      if slope == 0:
+        break
+      volts = volts - error/slope
+      if vlimits:
+        volts = min(max(volts, vlimits[0]), vlimits[1])
+    if volts != history[0][0]:
+      # record_reading() must compare with the calibrated gain at the final
+      # voltage, which is only known for a model
+      model = getattr(self.spline, "__self__", self.spline)
+      if hasattr(model, "gain_range"):
+        self._cal_gain = float(model(volts))
+      else:
+        self._cal_gain = None
+    self.atten = self.max_gain - (power - self.ref_power)
+    result = {"atten": self.atten, "error": error, "volts": volts,
+              "iterations": len(history), "elapsed": time.time() - start,
+              "converged": abs(error) <= tolerance}
+    if not result["converged"]:
+      self.logger.warning("set_atten_closed_loop: %f dB requested; error %f dB",
+                          atten, error)
+    return result
+
 
 # ---------------------------- module methods ---------------------------------
 
-def get_splines(filename):
+def _read_splines(filename, mmap=False):
+  """
+  Read a calibration file without using the cache
+  """
+  if filename.endswith(".npz"):
+    splines = load_calibration(filename, mmap=mmap)
+    if not mmap:
+      # the tables are shared through the cache so make them read-only
+      for table, ranges in splines:
+        if not isinstance(table, SplineTable):
+          continue
+        for array in (table.breaks, table.coefs, table.npts):
+          array.flags.writeable = False
+    return splines
+  module_logger.warning("get_splines: %s is a pickle; convert it with %s",
+                        filename, "calfile.convert_pickle()")
+  import dill as pickle
+  with open(filename, 'rb') as fd:
+    splines = pickle.load(fd)
+  return splines
+
+calibration_cache = FileCache(_read_splines, maxsize=16)
+
+def get_splines(filename, mmap=False, reload=False):
   """
   Get the spline interpolators and ranges of validity
 
-  Spline interpolator foles are of the form::
+  Calibration files are normally .npz files written by
+  calfile.save_calibration().  Old dill pickle files, which should be converted
+  with calfile.convert_pickle(), are still read.  Either way the result is of
+  the form::
     ( ( {'R1-18-E': <scipy.interpolate.interpolate.interp1d at 0xc1de90>,
          'R1-18-H': <scipy.interpolate.interpolate.interp1d at 0xc1d990>,
          ...
@@ -146,12 +462,23 @@ def get_splines(filename):
   independent variable, which is control voltage in the first and attenuation
   in the second.
 
-  @param filename : full path to dill pickle file
+  @param filename : full path to .npz (or legacy dill pickle) file
   @type  filename : str
 
+  Files are kept in 'calibration_cache', keyed by path and modification
+  time, so every caller gets the same read-only tables and a file is read
+  again only when it changes.  A memory-mapped file is not cached because a
+  file rewritten in place would corrupt the mapping.
+
+  @param mmap : memory-map the calibration arrays instead of caching them
+  @type  mmap : bool
+
+  @param reload : read the file even if the cached copy is current
+  @type  reload : bool
+
   @return: tuple of tuples of dicts
   """
-  fd = open(filename,'rb')
-  splines = pickle.load(fd)
-  return splines
+  if mmap:
+    return _read_splines(filename, mmap=True)
+  return calibration_cache.get(filename, reload=reload)
   
@@ -32,14 +32,17 @@ So the WBDC2 configuration is::
 """
 import logging
 import numpy as NP
-import time
 import sys
 from pylab import *
-from scipy.interpolate import interp1d
-import dill as pickle
 
 from support.pyro import get_device_server
 
+from Electronics.Instruments.PINatten.calfile import save_calibration
+from Electronics.Instruments.PINatten.calibration import settled_reading
+from Electronics.Instruments.PINatten.dataset import load_dataset
+from Electronics.Instruments.PINatten.model import fit_models, InverseTable
+from Electronics.Instruments.PINatten.pipeline import (colors, column_marker,
+                                                       sampling_points)
 from MonitorControl import ClassInstance
 from MonitorControl.Receivers.WBDC.WBDC2.WBDC2hwif import WBDC2hwif
 
@@ -50,7 +53,9 @@ def get_calibration_data(Pinatten, pm,
                            bias=None,
                            save=True,
                            filename=None,
-                           show_progress=False):
+                           show_progress=False,
+                           tolerance=0.02,
+                           max_wait=2.0):
   """
   Obtains measured power as a function of control voltage and bias voltage
 
@@ -62,6 +67,10 @@ def get_calibration_data(Pinatten, pm,
     - Pinatten.bias_list
     - Pinatten.volts
     - Pinatten.pwrs
+    - Pinatten.settle_times
+
+  Each reading is taken as soon as the power meter has settled (see
+  Electronics.Instruments.PINatten.calibration.settled_reading).
 
   @type pm : Gpib.Gpib instance
   @param pm : power meter for the power readings
@@ -83,12 +92,18 @@ def get_calibration_data(Pinatten, pm,
   the data will not be saved.  If it is "", the file will be in the
   current directory with a default name
 
+  @type tolerance : float
+  @param tolerance : dB by which settled readings may differ
+
+  @type max_wait : float
+  @param max_wait : longest time (s) to wait for a reading to settle
+
   @return: dictionary of control voltage lists, dictionary of measured
   powers, both indexed by bias voltage, and a list of biases.
   """
   if True:
     # just to compensate for old indentation
-    pwrs = {}
+    Pinatten.pwrs = {}
     if bias == None:
       Pinatten.bias_list = [2, 2.5, 3, 3.5, 4]
     elif type(bias) == float or type(bias) == int:
@@ -103,20 +118,26 @@ def get_calibration_data(Pinatten, pm,
       maxV = round(limits[1]*4)/4.
     num_steps = int((maxV - minV)/.25)+1
     Pinatten.volts = NP.linspace(minV,maxV,num_steps)
+    Pinatten.settle_times = {}
+    read = lambda: float(pm.read().strip())
     for bias in Pinatten.bias_list:
       if show_progress:
-        print "Doing bias of",bias,"V",
+        print("Doing bias of", bias, "V", end=" ")
       Pinatten.pwrs[bias] = []
+      Pinatten.settle_times[bias] = []
       for volt in Pinatten.volts:
         Pinatten.setVoltages([bias,volt])
         if show_progress:
-          print ".",
+          print(".", end=" ")
           sys.stdout.flush()
-        # Give the power meter time to range and settle
-        time.sleep(1)
-        Pinatten.pwrs[bias].append(float(pm.read().strip()))
+        # wait for the power meter to range and settle
+        power, settle_time, settled = settled_reading(read,
+                                                      tolerance=tolerance,
+                                                      max_wait=max_wait)
+        Pinatten.pwrs[bias].append(power)
+        Pinatten.settle_times[bias].append(settle_time)
       if show_progress:
-        print
+        print()
 
     text = "# Attenuator "+str(Pinatten.ID)+"\n"
     text += "# Biases: "+str(Pinatten.bias_list)+"\n"
@@ -135,115 +156,30 @@ def get_calibration_data(Pinatten, pm,
 
 def get_atten_IDs(filename):
   """
-  Read data from a comma-separated data file
+  Serial numbers of the attenuators in a comma-separated data file
 
-  Row 1 - reference (input) power level
-  Row 2 - bias voltage
-  Row 3 - total resistance in control voltage circuit
-  Row 4 - serial number
-  Row 5 - Receiver chain
-  Row 6 - Frequency and polarization of channel
-  Rows 7+ contain the data, with control voltage in column 0.
+  The file format is described in Electronics.Instruments.PINatten.dataset.
 
-  @return:  power (dict of floats), ctlvolts (dict of floats), refpower (list of str)
+  @return: serial number and A or B (str) keyed by channel ID
   """
-  serialnos = loadtxt(filename, delimiter=',', skiprows=3, dtype=str)[0,1:]
-  rxs =       loadtxt(filename, delimiter=',', skiprows=4, dtype=str)[0,1:]
-  headers =   loadtxt(filename, delimiter=',', skiprows=5, dtype=str)[0,1:]
-  ID = {}
-  for index in range(0, len(headers), 2):
-    chanIDa = rxs[index]+'-'+headers[index].replace(' ','-')
-    chanIDb = rxs[index]+'-'+headers[index+1].replace(' ','-')
-    ID[chanIDa] = serialnos[index]+'A'
-    ID[chanIDb] = serialnos[index]+'B'
-  return ID
+  dataset = load_dataset(filename)
+  return dict(zip(dataset.chanIDs, dataset.serials))
 
 #---------------------------- functions for obtaining splines -----------------
 
-def get_splines(x, y, indices):
-  """
-  Get spline interpolator and limits on its validity
-
-  @param x : dict of X values
-  @type  x : dict of float
-
-  @param y : dict of Y values
-  @type  y : dict of float
-
-  @param indices : keys of the X and Y arrays to be fitted
-  @type  indices : type of X and Y keys
-
-  @return: dict of interp1d instances, sample points (min, max, step)
-  """
-  spl = {}
-  sample_range = {}
-  for index in indices:
-    minx = x[index].min()
-    maxx = x[index].max()
-    module_logger.debug("get_splines: for %d between %f and %f",
-                        index, minx, maxx)
-    if x[index][0] > x[index][-1]:
-      module_logger.debug("inverting data order so x[0] < x[-1]")
-      x[index] = x[index][::-1]
-      y[index] = y[index][::-1]
-    module_logger.debug("%s", x[index])
-    spl[index] = interp1d(x[index], y[index], kind='cubic')
-    sample_range[index] = sampling_points(minx,maxx)
-  return spl, sample_range
-  
-def sampling_points(vmin, vmax, vstep=None):
-  """
-  Create a nicely spaced set of sampling points at which to evaluate
-  
-  @param vmin : minimum abscissa
-  @type  vmin : float
-  
-  @param vmax : maximum abscissa
-  @type  vmax : float
-  
-  @param vstep : optional abscissa step size
-  @type  vstep : float or None
-  
-  @return: tuple
-  """
-  if vstep == None:
-    vrange = float(vmax)-float(vmin)
-    module_logger.debug("sampling_points: range=%f", vrange)
-    appr_vstep = abs(vrange/100.)
-    module_logger.debug("sampling_points: appr. step = %f", appr_vstep)
-    vstep_order_of_magnitude = int(floor(log10(appr_vstep)))
-    module_logger.debug("sampling_points: order of magnitude = %d",
-                        vstep_order_of_magnitude)
-    vstep = pow(10.,vstep_order_of_magnitude)
-    module_logger.debug("sampling_points: step=%f", vstep)
-  i_start = int(vmin/vstep)
-  i_stop = int(vmax/vstep)
-  module_logger.debug("sampling points: multiplier from %d to %d",
-                      i_start,i_stop)
-  if i_stop > i_start:
-    if i_start*vstep < vmin:
-      i_start = i_start+1
-    if i_stop*vstep > vmax:
-      i_stop = i_stop-1
-    return i_start*vstep, i_stop*vstep, vstep
-  else:
-    if i_stop*vstep < vmax:
-      i_stop = i_stop+1
-    return i_start*vstep, i_stop*vstep, -vstep
-  
 def interpolate(att_spline, indices, range_info=None):
   """
   Interpolate a dict of splines over their ranges
 
   @param att_spline : dict of spline interpolators
-  @type  att_spline : dict of interp1d instances
+  @type  att_spline : dict of AttenuatorModel instances, or InverseTable
 
   @param indices : keys of the X and Y arrays to be fitted
   @type  indices : type of X and Y keys
 
   @param range_info : (start, stop, step); default: (-10, 0.5, 0.1)
   @type  range_info : dict of tuples of floats
-  @return: dict of interp1d instances, sample points (min, max, step)
+  @return: dict of sample points, dict of interpolated values
   """
   v = {}
   db = {}
@@ -257,38 +193,23 @@ def interpolate(att_spline, indices, range_info=None):
     db[index] = att_spline[index](v[index])
   return v, db
 
-def get_derivative(db, indices, Vstep=0.1):
+def get_derivative(models, v, indices):
   """
-  Gets the derivatives of a set of vectors
+  Gets the analytic slopes of the models at the sample points
   """
   slopes = {}
   for index in indices:
-    slopes[index] = (db[index][1:]-db[index][:-1])/Vstep
+    slopes[index] = models[index].derivative(v[index])
   return slopes
 
 #----------------------- functions for plotting results -----------------------
 
-colors = ['b','g','r','c','m','y','k']
-
-def column_marker(column):
-  """
-  Unique markers modulo 7
-  """
-  if (column)//7 == 0:
-    marker = 'x'
-  elif (column)//7 == 1:
-    marker = '+'
-  else:
-    marker = 'd'
-  return marker
-
 def rezero_data(V, P, refs):
   """
-  Plot measured data
+  Attenuation relative to the reference powers
   """
   att = {}
-  keys = V.keys()
-  keys.sort()
+  keys = sorted(V.keys())
   for key in keys:
     index = keys.index(key)
     att[key] = []
@@ -306,8 +227,8 @@ def plot_data(V, P, refs):
   xlabel('Control Volts (V)')
   ylabel('Insertion Loss (dB)')
   title("Attenuation Curves")
-  keys = V.keys()
-  keys.sort()
+  att = rezero_data(V, P, refs)
+  keys = sorted(V.keys())
   for key in keys:
     index = keys.index(key)
     plot(V[key], att[key], ls='-', marker=column_marker(index),
@@ -316,8 +237,7 @@ def plot_data(V, P, refs):
   
 def plot_fit(V, att, v, db, labels, keys, Vstep=0.1, toplabel=""):
   # plot data
-  allkeys = V.keys()
-  allkeys.sort()
+  allkeys = sorted(V.keys())
   for key in keys:
     index = allkeys.index(key)
     plot(V[key], att[key], color=colors[index % 7],
@@ -334,12 +254,12 @@ def plot_fit(V, att, v, db, labels, keys, Vstep=0.1, toplabel=""):
 
 def plot_gradients(v, gradient, keys):
   """
+  Plot the slopes of the fits
   """
-  allkeys = v.keys()
-  allkeys.sort()
+  allkeys = sorted(v.keys())
   for key in keys:
     index = allkeys.index(key)
-    plot(v[key][1:], gradient[key], color=colors[index % 7],
+    plot(v[key], gradient[key], color=colors[index % 7],
          marker=column_marker(index), ls='-', label=key)
   grid()
   xlabel('Control Volts (V)')
@@ -358,13 +278,13 @@ if __name__ == "__main__":
   if gethostname() == 'dss43wbdc2':
     ## Needed when data are to be acquired
     fe = get_device_server("FE_server-krx43", "crux")
-    print "Feed 1 load is:",fe.set_WBDC(13) # set feed 1 to sky
-    print "Feed 2 load is:",fe.set_WBDC(15) # set feed 2 to sky
-    #print fe.set_WBDC(14) # set feed 1 to load
-    #print fe.set_WBDC(16) # set feed 2 to load
+    print("Feed 1 load is:", fe.set_WBDC(13)) # set feed 1 to sky
+    print("Feed 2 load is:", fe.set_WBDC(15)) # set feed 2 to sky
+    #print(fe.set_WBDC(14)) # set feed 1 to load
+    #print(fe.set_WBDC(16)) # set feed 2 to load
     for pm in ['PM1', 'PM2', 'PM3', 'PM4']:
       # set PMs to dBm
-      print fe.set_WBDC(400+int(pm[-1]))
+      print(fe.set_WBDC(400+int(pm[-1])))
     
 
   if gethostname() == 'dss43wbdc2':
@@ -376,35 +296,41 @@ if __name__ == "__main__":
     pol_secs = {'R1-22': rx.pol_sec['R1-22'], 'R2-22': rx.pol_sec['R2-22']}
     attenuators = {
        'R1-22-E': pol_secs['R1-22'].atten['R1-22-E'],
-		   'R1-22-H': pol_secs['R1-22'].atten['R1-22-H'],
-		   'R2-22-E': pol_secs['R2-22'].atten['R2-22-E'],
-		   'R2-22-H': pol_secs['R2-22'].atten['R2-22-H']}
+       'R1-22-H': pol_secs['R1-22'].atten['R1-22-H'],
+       'R2-22-E': pol_secs['R2-22'].atten['R2-22-E'],
+       'R2-22-H': pol_secs['R2-22'].atten['R2-22-H']}
   
-    pkeys = pol_secs.keys(); pkeys.sort()
-    akeys = attenuators.keys(); akeys.sort()
+    pkeys = sorted(pol_secs.keys())
+    akeys = sorted(attenuators.keys())
     mylogger.debug(" pol section keys: %s", pkeys)
     mylogger.debug(" attenuator keys: %s", akeys)
   
     # this goes from mininum attenuation to manimum attenuation
-    ctl_volts = range(-10,0) + list(NP.arange(-0.9,0,0.1)) \
+    ctl_volts = list(range(-10,0)) + list(NP.arange(-0.9,0,0.1)) \
                              + list(NP.arange(0,0.8,0.05))
     powers  = {} # dict of lists of measured powers
     for atn in akeys:
       powers[atn] = []
+    settle_times = []
+    read_pms = lambda: [reading[2] for reading in fe.read_pms()]
     for ctlV in ctl_volts:
       for atn in akeys:
-	      attenuators[atn].VS.setVoltage(ctlV)
-      time.sleep(0.5)
-      # read all the power meters
-      response = fe.read_pms()
-      data =  []
+        attenuators[atn].VS.setVoltage(ctlV)
+      # read all the power meters once they have settled
+      response, settle_time, settled = settled_reading(read_pms)
+      settle_times.append(settle_time)
+      if not settled:
+        mylogger.warning(" readings at %f V did not settle", ctlV)
       for index in range(len(response)):
-	      powers[akeys[index]].append(response[index][2])
-    print powers
+        powers[akeys[index]].append(response[index])
+    print(powers)
+    mylogger.info(" settle times: mean %.2f s, longest %.2f s at %f V",
+                  NP.mean(settle_times), max(settle_times),
+                  ctl_volts[int(NP.argmax(settle_times))])
  
     for pm in ['PM1', 'PM2', 'PM3', 'PM4']:
       # set PMs to W
-      print fe.set_WBDC(390+int(pm[-1]))
+      print(fe.set_WBDC(390+int(pm[-1])))
   elif gethostname() == 'kuiper':
     # this goes from mininum attenuation to manimum attenuation
     ctl_volts = [ -10,  -9,  -8, -7, -6, -5, -4, -3, -2, -1, -0.75, -0.5, -0.25,
@@ -427,12 +353,11 @@ if __name__ == "__main__":
                 -37.74499, -40.136,   -41.81199, -43.966,   -45.856,   -46.622,
                 -46.892,   -46.997,   -47.058,   -47.088]}
   else:
-    print "Need code for host", gethostname()
+    print("Need code for host", gethostname())
     sys.exit()
 
   cv = {}
-  pkeys = powers.keys()
-  pkeys.sort()
+  pkeys = sorted(powers.keys())
   refs = []
   for key in pkeys:
     cv[key] = NP.array(ctl_volts)
@@ -443,19 +368,23 @@ if __name__ == "__main__":
   att = rezero_data(cv, powers, refs)
 
   # Now do the fitting:
-  att_spline,  V_sample_range   = get_splines(cv, att, pkeys)
-  ctlV_spline, att_sample_range = get_splines(att, cv, pkeys)
+  models = fit_models(cv, att, pkeys)
+  V_sample_range = {}
+  att_sample_range = {}
+  for key in pkeys:
+    V_sample_range[key] = sampling_points(*models[key].volts_range)
+    att_sample_range[key] = sampling_points(*models[key].gain_range)
+  att_spline = models
+  ctlV_spline = InverseTable(models)
 
   # verify the fits
   v, dB    = interpolate(att_spline,  pkeys, V_sample_range)
   db, ctlV = interpolate(ctlV_spline, pkeys, att_sample_range)
 
   # save the data
-  module_path = "/usr/local/lib/python2.7/DSN-Sci-packages/MonitorControl/Receivers/WBDC/WBDC2/"
-  splfile = open(module_path+"splines.pkl","wb")
-  pickle.dump(((att_spline, V_sample_range),
-               (ctlV_spline,att_sample_range)), splfile)
-  splfile.close()
+  # in the current directory; install it where the receiver software reads it
+  save_calibration("splines.npz", (models, V_sample_range),
+                                  (None, att_sample_range))
 
   # plot the data
   figure(1)
@@ -465,13 +394,13 @@ if __name__ == "__main__":
   # plot the fits
   figure(2)
   plot_fit(cv, att, v, dB, pkeys, pkeys,
-           toplabel='Cubic spline interpolation on dB')
+           toplabel='Monotone (PCHIP) interpolation on dB')
   figure(3)
   plot_fit(cv, att, ctlV, db, pkeys, pkeys,
-           toplabel='Cubic spline interpolation on V')
+           toplabel='Inverse of monotone interpolation')
 
   # get the slopes
-  att_gradient = get_derivative(dB, pkeys)
+  att_gradient = get_derivative(models, v, pkeys)
   # analyze the slopes
   figure(4)
   plot_gradients(v, att_gradient, pkeys)
@@ -0,0 +1,87 @@
+"""
+Cache of objects loaded from files, keyed by path and modification time
+
+A FileCache holds the result of loading a file for as long as the file does not
+change.  Every lookup checks the file's modification time and size, so an
+edited or replaced file is reloaded on the next lookup without restarting the
+program.  The least recently used entries are dropped when there are more than
+'maxsize' of them.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+module_logger = logging.getLogger(__name__)
+
+class FileCache(object):
+  """
+  Least-recently-used cache of loaded files
+
+  @ivar hits : number of lookups answered from the cache
+  @type hits : int
+
+  @ivar misses : number of lookups which (re)loaded the file
+  @type misses : int
+  """
+  def __init__(self, loader, maxsize=16):
+    """
+    @param loader : function which takes a file name and returns its contents
+    @type  loader : callable
+
+    @param maxsize : maximum number of files kept
+    @type  maxsize : int
+    """
+    self.loader = loader
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+    self.logger = logging.getLogger(module_logger.name+".FileCache")
+
+  def get(self, filename, reload=False):
+    """
+    Return the contents of a file, loading it if it is new or has changed
+
+    @param filename : name of the file
+    @type  filename : str
+
+    @param reload : load the file even if the cached copy is current
+    @type  reload : bool
+    """
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with self._lock:
+      if not reload and path in self._entries:
+        entry_stamp, contents = self._entries[path]
+        if entry_stamp == stamp:
+          self._entries.move_to_end(path)
+          self.hits += 1
+          return contents
+        self.logger.info("get: %s has changed; reloading", path)
+      self.misses += 1
+      contents = self.loader(path)
+      self._entries[path] = (stamp, contents)
+      self._entries.move_to_end(path)
+      while len(self._entries) > self.maxsize:
+        dropped, _ = self._entries.popitem(last=False)
+        self.logger.debug("get: evicted %s", dropped)
+      return contents
+
+  def invalidate(self, filename=None):
+    """
+    Forget one file, or all files if no name is given
+    """
+    with self._lock:
+      if filename is None:
+        self._entries.clear()
+      else:
+        self._entries.pop(os.path.abspath(filename), None)
+
+  def __contains__(self, filename):
+    return os.path.abspath(filename) in self._entries
+
+  def __len__(self):
+    return len(self._entries)
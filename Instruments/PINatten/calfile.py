@@ -0,0 +1,367 @@
+"""
+Portable calibration files for PIN diode attenuators
+
+Calibrations used to be saved as dill pickles of scipy.interpolate.interp1d
+instances.  Those depend on scipy internals and must be unpickled, which is
+slow and unsafe.  This module saves the same information as plain arrays in an
+uncompressed numpy .npz file::
+
+  version      - file format version (int)
+  channels     - channel IDs, e.g. 'R1-18-E' (str)
+  att_breaks   - control voltage breakpoints of the attenuation splines
+  att_coefs    - cubic coefficients for each interval, highest power first
+  att_npts     - number of valid breakpoints for each channel
+  att_range    - (start, stop, step) for sampling each spline
+  ctlV_breaks  - attenuation breakpoints of the control voltage splines
+  ctlV_coefs, ctlV_npts, ctlV_range - as above
+
+Version 2 files hold monotone models (see model.py).  They have no ctlV
+splines because the control voltage is found by inverting the att curves;
+ctlV_range is still given.  Channels with fewer points are padded with NaN.
+Because the file is not compressed, the arrays can be memory-mapped directly
+from disk.
+
+The loader returns the same structure as the old pickle files::
+  ((att_spline, V_sample_range), (ctlV_spline, att_sample_range))
+in which the splines are SplineTable (or, for version 2, model.InverseTable)
+objects which behave like the dicts of interp1d instances they replace.
+
+Old pickle files are converted with::
+  python calfile.py splines.pkl splines.npz
+"""
+import logging
+import struct
+import sys
+import zipfile
+from collections.abc import Mapping
+
+import numpy as NP
+
+module_logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+
+class PiecewiseCubic(object):
+  """
+  Cubic polynomial pieces between breakpoints
+
+  This is evaluated with numpy only so it does not depend on which version of
+  scipy created it.
+
+  @ivar x : breakpoints in ascending order
+  @type x : numpy array of float
+
+  @ivar coefs : coefficients, shape (4, len(x)-1), highest power first
+  @type coefs : numpy array of float
+  """
+  def __init__(self, x, coefs):
+    """
+    @param x : breakpoints in ascending order
+    @type  x : numpy array of float
+
+    @param coefs : polynomial coefficients for each interval
+    @type  coefs : numpy array of float, shape (4, len(x)-1)
+    """
+    self.x = x
+    self.coefs = coefs
+
+  def __call__(self, x_new):
+    """
+    Evaluate, raising ValueError outside the breakpoints like interp1d
+    """
+    x_new = NP.asarray(x_new, dtype=float)
+    if NP.any((x_new < self.x[0]) | (x_new > self.x[-1])):
+      raise ValueError("A value in x_new is out of the interpolation range.")
+    index = self._interval(x_new)
+    dx = x_new - self.x[index]
+    c = self.coefs
+    return ((c[0,index]*dx + c[1,index])*dx + c[2,index])*dx + c[3,index]
+
+  def derivative(self, x_new):
+    """
+    Analytic first derivative
+    """
+    x_new = NP.asarray(x_new, dtype=float)
+    index = self._interval(x_new)
+    dx = x_new - self.x[index]
+    c = self.coefs
+    return (3*c[0,index]*dx + 2*c[1,index])*dx + c[2,index]
+
+  def _interval(self, x_new):
+    """
+    Index of the polynomial piece for each abscissa
+    """
+    index = NP.searchsorted(self.x, x_new, side='right') - 1
+    return NP.clip(index, 0, len(self.x)-2)
+
+  @property
+  def y(self):
+    """
+    Values at the breakpoints
+    """
+    dx = self.x[-1] - self.x[-2]
+    c = self.coefs[:,-1]
+    last = ((c[0]*dx + c[1])*dx + c[2])*dx + c[3]
+    return NP.append(self.coefs[3], last)
+
+
+class SplineTable(Mapping):
+  """
+  Splines for a set of channels stored as padded 2-D arrays
+
+  Indexing with a channel ID returns a PiecewiseCubic which shares memory
+  with the table, so a memory-mapped table is not copied.
+
+  @ivar channels : channel IDs
+  @type channels : list of str
+
+  @ivar breaks : breakpoints, shape (num_chans, max_points), NaN padded
+  @type breaks : numpy array of float
+
+  @ivar coefs : coefficients, shape (num_chans, 4, max_points-1)
+  @type coefs : numpy array of float
+
+  @ivar npts : number of valid breakpoints for each channel
+  @type npts : numpy array of int
+  """
+  def __init__(self, channels, breaks, coefs, npts):
+    self.channels = [str(chan) for chan in channels]
+    self.breaks = breaks
+    self.coefs = coefs
+    self.npts = npts
+    self._index = dict(zip(self.channels, range(len(self.channels))))
+
+  def __getitem__(self, chanID):
+    index = self._index[chanID]
+    n = int(self.npts[index])
+    return PiecewiseCubic(self.breaks[index,:n], self.coefs[index,:,:n-1])
+
+  def __iter__(self):
+    return iter(self.channels)
+
+  def __len__(self):
+    return len(self.channels)
+
+  def evaluate(self, x_new, nu=0):
+    """
+    Evaluate all the channels at once
+
+    Points outside a channel's breakpoints give NaN.
+
+    @param x_new : one grid for all channels or one row for each channel
+    @type  x_new : numpy array, shape (num_points,) or (num_chans, num_points)
+
+    @param nu : 0 for the value, 1 for the first derivative
+    @type  nu : int
+
+    @return: numpy array, shape (num_chans, num_points)
+    """
+    x_new = NP.asarray(x_new, dtype=float)
+    x_new = NP.broadcast_to(x_new, (len(self.channels), x_new.shape[-1]))
+    npts = NP.asarray(self.npts)[:,NP.newaxis]
+    # number of breakpoints after the first which are <= x; NaN padding
+    # never compares true
+    index = NP.sum(x_new[:,:,NP.newaxis] >= self.breaks[:,NP.newaxis,1:],
+                   axis=2)
+    index = NP.minimum(index, npts-2)
+    dx = x_new - NP.take_along_axis(self.breaks, index, axis=1)
+    c = [NP.take_along_axis(self.coefs[:,power], index, axis=1)
+         for power in range(4)]
+    if nu == 0:
+      result = ((c[0]*dx + c[1])*dx + c[2])*dx + c[3]
+    elif nu == 1:
+      result = (3*c[0]*dx + 2*c[1])*dx + c[2]
+    else:
+      raise ValueError("only nu=0 or 1 is supported")
+    last = NP.take_along_axis(self.breaks, npts-1, axis=1)
+    outside = (x_new < self.breaks[:,:1]) | (x_new > last)
+    return NP.where(outside, NP.nan, result)
+
+  @classmethod
+  def from_splines(cls, splines, channels=None):
+    """
+    Pack a dict of splines into arrays
+
+    @param splines : spline interpolators indexed by channel ID
+    @type  splines : dict of PiecewiseCubic or cubic interp1d instances
+
+    @param channels : order of the channels; default: sorted keys
+    @type  channels : list of str
+    """
+    if channels is None:
+      channels = sorted(splines.keys())
+    pieces = [as_piecewise(splines[chan]) for chan in channels]
+    npts = NP.array([len(piece.x) for piece in pieces], dtype=int)
+    maxpts = npts.max()
+    breaks = NP.full((len(pieces), maxpts), NP.nan)
+    coefs = NP.full((len(pieces), 4, maxpts-1), NP.nan)
+    for index, piece in enumerate(pieces):
+      n = npts[index]
+      breaks[index,:n] = piece.x
+      coefs[index,:,:n-1] = piece.coefs
+    return cls(channels, breaks, coefs, npts)
+
+
+# ---------------------------- module methods ---------------------------------
+
+def fit_cubic(x, y):
+  """
+  Fit a not-a-knot cubic spline, as interp1d(kind='cubic') does
+
+  @param x : abscissae; they will be sorted into ascending order
+  @type  x : numpy array of float
+
+  @param y : ordinates
+  @type  y : numpy array of float
+
+  @return: PiecewiseCubic instance
+  """
+  from scipy.interpolate import CubicSpline
+  x = NP.asarray(x, dtype=float)
+  y = NP.asarray(y, dtype=float)
+  order = NP.argsort(x)
+  spline = CubicSpline(x[order], y[order], bc_type='not-a-knot')
+  return PiecewiseCubic(spline.x, spline.c)
+
+def as_piecewise(spline):
+  """
+  Convert a spline interpolator to a PiecewiseCubic
+
+  An interp1d instance is refitted from its data points which is what
+  interp1d(kind='cubic') does internally.
+  """
+  if isinstance(spline, PiecewiseCubic):
+    return spline
+  if hasattr(spline, "curve"):
+    # a model.AttenuatorModel
+    return spline.curve
+  return fit_cubic(spline.x, spline.y)
+
+def save_calibration(filename, att, ctlV):
+  """
+  Save attenuator calibration splines
+
+  @param filename : name of the .npz file
+  @type  filename : str
+
+  @param att : attenuation splines and control voltage sampling ranges
+  @type  att : (dict of splines, dict of (start, stop, step))
+
+  @param ctlV : control voltage splines and attenuation sampling ranges
+  @type  ctlV : (dict of splines, dict of (start, stop, step))
+
+  If the control voltage splines are None, the att splines must be monotone
+  (e.g. model.AttenuatorModel instances) and a version 2 file is written.
+  """
+  channels = sorted(att[0].keys())
+  monotone = ctlV[0] is None
+  arrays = {"version": NP.array(2 if monotone else 1),
+            "channels": NP.array(channels, dtype=str)}
+  for prefix, (splines, ranges) in (("att", att), ("ctlV", ctlV)):
+    if splines is not None:
+      table = SplineTable.from_splines(splines, channels)
+      arrays[prefix+"_breaks"] = table.breaks
+      arrays[prefix+"_coefs"] = table.coefs
+      arrays[prefix+"_npts"] = table.npts
+    arrays[prefix+"_range"] = NP.array([ranges[chan] for chan in channels],
+                                       dtype=float)
+  NP.savez(filename, **arrays)
+  module_logger.debug("save_calibration: wrote %d channels to %s",
+                      len(channels), filename)
+
+def load_calibration(filename, mmap=False):
+  """
+  Load attenuator calibration splines
+
+  @param filename : name of the .npz file
+  @type  filename : str
+
+  @param mmap : memory-map the arrays instead of reading them
+  @type  mmap : bool
+
+  @return: ((att_spline, V_sample_range), (ctlV_spline, att_sample_range))
+  """
+  arrays = None
+  if mmap:
+    arrays = _mmap_npz(filename)
+  if arrays is None:
+    with NP.load(filename) as npz:
+      arrays = dict(npz)
+  version = int(arrays["version"])
+  if version > FORMAT_VERSION:
+    raise ValueError("%s has format version %d; this code reads up to %d"
+                     % (filename, version, FORMAT_VERSION))
+  channels = [str(chan) for chan in arrays["channels"]]
+  result = []
+  for prefix in ("att", "ctlV"):
+    if prefix+"_breaks" in arrays:
+      table = SplineTable(channels, arrays[prefix+"_breaks"],
+                          arrays[prefix+"_coefs"], arrays[prefix+"_npts"])
+    else:
+      # monotone models are inverted instead of having ctlV splines
+      from Electronics.Instruments.PINatten.model import (ModelTable,
+                                                          InverseTable)
+      table = InverseTable(ModelTable(result[0][0]))
+    ranges = dict(zip(channels,
+                      [tuple(row) for row in arrays[prefix+"_range"].tolist()]))
+    result.append((table, ranges))
+  return tuple(result)
+
+def convert_pickle(pklfile, npzfile=None):
+  """
+  Convert an old dill pickle of interp1d splines to the .npz format
+
+  @param pklfile : name of the pickle file
+  @type  pklfile : str
+
+  @param npzfile : name of the new file; default: pklfile with .npz
+  @type  npzfile : str
+
+  @return: name of the new file
+  """
+  import dill as pickle
+  if npzfile is None:
+    npzfile = pklfile.rsplit('.', 1)[0]+".npz"
+  with open(pklfile, 'rb') as fd:
+    att, ctlV = pickle.load(fd)
+  save_calibration(npzfile, att, ctlV)
+  return npzfile
+
+def _mmap_npz(filename):
+  """
+  Memory-map the members of an uncompressed .npz file
+
+  Returns None if the file cannot be mapped, e.g. if it is compressed.
+  """
+  arrays = {}
+  with open(filename, 'rb') as fd, zipfile.ZipFile(fd) as zf:
+    for info in zf.infolist():
+      if info.compress_type != zipfile.ZIP_STORED:
+        return None
+      # skip the local file header to get to the .npy data
+      fd.seek(info.header_offset)
+      header = fd.read(30)
+      name_len, extra_len = struct.unpack('<HH', header[26:30])
+      fd.seek(info.header_offset + 30 + name_len + extra_len)
+      version = NP.lib.format.read_magic(fd)
+      if version == (1, 0):
+        shape, fortran, dtype = NP.lib.format.read_array_header_1_0(fd)
+      else:
+        shape, fortran, dtype = NP.lib.format.read_array_header_2_0(fd)
+      key = info.filename[:-4] if info.filename.endswith(".npy") \
+                               else info.filename
+      if dtype.hasobject or 0 in shape:
+        return None
+      arrays[key] = NP.memmap(filename, dtype=dtype, mode='r',
+                              offset=fd.tell(), shape=shape,
+                              order='F' if fortran else 'C')
+  return arrays
+
+
+if __name__ == "__main__":
+  logging.basicConfig(level=logging.INFO)
+  if len(sys.argv) < 2:
+    print("Usage: calfile.py picklefile [npzfile]")
+    sys.exit(1)
+  npzfile = convert_pickle(*sys.argv[1:3])
+  module_logger.info("converted %s to %s", sys.argv[1], npzfile)
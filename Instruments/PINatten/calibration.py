@@ -0,0 +1,426 @@
+"""
+Support for measuring PIN diode attenuator calibrations
+
+After a control voltage is changed the power meter needs time to range and
+settle.  Instead of waiting a fixed time, settled_reading() polls the meter
+until consecutive readings agree.
+
+A CalibrationEngine steps any number of attenuators through their bias and
+control voltage schedules together, reading all their power meters in
+parallel threads, so calibrating many channels takes about as long as one.
+The results are collected in a numpy structured array with the fields in
+DATASET_DTYPE.
+
+Rather than a fixed grid of control voltages, adaptive_volts() starts with a
+coarse grid and adds points only where the curves bend sharply, which for PIN
+diodes is near and just above 0 V.
+
+If the engine is given a journal file, every reading is appended to it (one
+JSON object per line) and flushed to disk as soon as it is taken.  A new
+engine with the same journal resumes the run, skipping the (attenuator, bias,
+control voltage) points already measured.
+"""
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as NP
+
+module_logger = logging.getLogger(__name__)
+
+DATASET_DTYPE = [("channel", "U32"),  # attenuator ID, e.g. 'R1-22-E'
+                 ("bias",    "f8"),   # bias voltage; NaN if not used
+                 ("volts",   "f8"),   # control voltage
+                 ("power",   "f8"),   # settled power meter reading
+                 ("settle",  "f8"),   # time taken to settle (s)
+                 ("settled", "?"),    # False if max_wait was reached
+                 ("time",    "f8")]   # UNIX time of the reading
+
+class CalibrationEngine(object):
+  """
+  Calibrates several attenuators at the same time
+
+  Each attenuator has its own power meter.  At every step all the attenuators
+  are set and then all the meters are read concurrently, each one as soon as
+  it has settled.
+
+  @ivar channels : (attenuator, power meter) keyed by channel ID
+  @type channels : dict of tuples
+
+  @ivar records : one tuple for each reading, as in DATASET_DTYPE
+  @type records : list of tuples
+
+  @ivar journal : file to which readings are appended, or None
+  @type journal : str
+  """
+  def __init__(self, channels, read=None, tolerance=0.02, max_wait=2.0,
+               interval=0.05, journal=None):
+    """
+    @param channels : (attenuator, power meter) keyed by channel ID
+    @type  channels : dict of tuples
+
+    @param read : function which takes a power meter and returns a reading;
+                  default: the meter's power() method
+    @type  read : callable
+
+    @param tolerance : dB by which settled readings may differ
+    @type  tolerance : float
+
+    @param max_wait : longest time (s) to wait for a reading to settle
+    @type  max_wait : float
+
+    @param interval : time (s) between samples while settling
+    @type  interval : float
+
+    @param journal : file for saving readings as they are taken; if it
+                     exists its readings are loaded and not measured again
+    @type  journal : str
+    """
+    self.channels = channels
+    self.chanIDs = sorted(channels.keys())
+    if read is None:
+      read = lambda pm: float(pm.power())
+    self.read = read
+    self.tolerance = tolerance
+    self.max_wait = max_wait
+    self.interval = interval
+    self.records = []
+    self.logger = logging.getLogger(module_logger.name+".CalibrationEngine")
+    self.journal = journal
+    self._done = {}
+    if journal and os.path.exists(journal):
+      for record in read_journal(journal):
+        self._add_record(record)
+      self.logger.info("__init__: resuming with %d readings from %s",
+                       len(self.records), journal)
+
+  def run(self, volts, biases=None):
+    """
+    Measure every attenuator at every bias and control voltage
+
+    @param volts : control voltages
+    @type  volts : list of float
+
+    @param biases : bias voltages; None for attenuators without bias control
+    @type  biases : list of float
+
+    @return: numpy structured array (see DATASET_DTYPE)
+    """
+    if biases is None:
+      biases = [None]
+    with ThreadPoolExecutor(max_workers=len(self.chanIDs)) as pool:
+      for bias in biases:
+        for volt in volts:
+          self.measure_point(bias, volt, pool)
+    return self.dataset()
+
+  def run_adaptive(self, vmin, vmax, biases=None, **kwargs):
+    """
+    Measure every attenuator with adaptively chosen control voltages
+
+    The same voltages are used for all channels; a point is added wherever
+    any channel needs it.  Keyword arguments are passed to adaptive_volts().
+
+    @param vmin : lowest control voltage
+    @type  vmin : float
+
+    @param vmax : highest control voltage
+    @type  vmax : float
+
+    @param biases : bias voltages; None for attenuators without bias control
+    @type  biases : list of float
+
+    @return: numpy structured array (see DATASET_DTYPE)
+    """
+    if biases is None:
+      biases = [None]
+    with ThreadPoolExecutor(max_workers=len(self.chanIDs)) as pool:
+      for bias in biases:
+        volts, powers = adaptive_volts(
+                              lambda volt: self.measure_point(bias, volt, pool),
+                              vmin, vmax, **kwargs)
+        self.logger.info("run_adaptive: bias %s needed %d points",
+                         bias, len(volts))
+    return self.dataset()
+
+  def measure_point(self, bias, volt, pool):
+    """
+    Set all the attenuators and read all the meters once
+
+    @param pool : executor used to read the meters concurrently
+    @type  pool : concurrent.futures.Executor
+
+    @return: numpy array of the powers, in the order of 'chanIDs'
+    """
+    todo = [chanID for chanID in self.chanIDs
+                   if _point_key(chanID, bias, volt) not in self._done]
+    if todo:
+      for chanID in self.chanIDs:
+        set_voltages(self.channels[chanID][0], bias, volt)
+      readings = pool.map(self._read_channel, todo)
+      for chanID, (power, settle, settled, when) in zip(todo, readings):
+        record = (chanID, NP.nan if bias is None else bias, volt,
+                  power, settle, settled, when)
+        self._add_record(record)
+        if self.journal:
+          append_journal(self.journal, record)
+      self.logger.debug("measure_point: bias %s, %f V done", bias, volt)
+    else:
+      self.logger.debug("measure_point: bias %s, %f V already measured",
+                        bias, volt)
+    return NP.array([self.records[self._done[_point_key(chanID, bias, volt)]][3]
+                     for chanID in self.chanIDs])
+
+  def _add_record(self, record):
+    """
+    Keep a reading and index it by its point
+    """
+    self._done[_point_key(*record[:3])] = len(self.records)
+    self.records.append(tuple(record))
+
+  def _read_channel(self, chanID):
+    """
+    Settled reading of one channel's power meter
+    """
+    pm = self.channels[chanID][1]
+    power, settle, settled = settled_reading(lambda: self.read(pm),
+                                             tolerance=self.tolerance,
+                                             interval=self.interval,
+                                             max_wait=self.max_wait)
+    return power, settle, settled, time.time()
+
+  def dataset(self):
+    """
+    All the readings taken so far as a structured array
+    """
+    return NP.array(self.records, dtype=DATASET_DTYPE)
+
+
+# ---------------------------- module methods ---------------------------------
+
+def _point_key(chanID, bias, volt):
+  """
+  Key identifying a calibration point; voltages are compared to 1 uV
+  """
+  if bias is None or NP.isnan(bias):
+    bias = None
+  else:
+    bias = round(float(bias), 6)
+  return (str(chanID), bias, round(float(volt), 6))
+
+def append_journal(filename, record):
+  """
+  Append a reading to a journal file and make sure it is on disk
+
+  @param record : reading with the fields of DATASET_DTYPE
+  @type  record : tuple
+  """
+  entry = dict(zip([name for name, dtype in DATASET_DTYPE], record))
+  if NP.isnan(entry["bias"]):
+    entry["bias"] = None
+  for key in ("bias", "volts", "power", "settle", "time"):
+    if entry[key] is not None:
+      entry[key] = float(entry[key])
+  entry["settled"] = bool(entry["settled"])
+  with open(filename, "ab+") as fd:
+    # start a new line if an interrupted write left a partial one
+    fd.seek(0, os.SEEK_END)
+    if fd.tell():
+      fd.seek(-1, os.SEEK_END)
+      if fd.read(1) != b"\n":
+        fd.write(b"\n")
+    fd.write((json.dumps(entry)+"\n").encode())
+    fd.flush()
+    os.fsync(fd.fileno())
+
+def read_journal(filename):
+  """
+  Readings saved in a journal file
+
+  A line left incomplete by an interruption is ignored.
+
+  @return: list of tuples with the fields of DATASET_DTYPE
+  """
+  records = []
+  with open(filename) as fd:
+    for line in fd:
+      try:
+        entry = json.loads(line)
+      except ValueError:
+        module_logger.warning("read_journal: skipping bad line in %s: %r",
+                              filename, line)
+        continue
+      if entry["bias"] is None:
+        entry["bias"] = NP.nan
+      records.append(tuple(entry[name] for name, dtype in DATASET_DTYPE))
+  return records
+
+def set_voltages(attenuator, bias, volt):
+  """
+  Set the control voltage, and the bias voltage if there is one
+
+  Attenuators with bias control have a setVoltages([bias, volt]) method;
+  others are set through their voltage source.
+  """
+  if bias is None:
+    return attenuator.VS.setVoltage(volt)
+  return attenuator.setVoltages([bias, volt])
+
+def channel_curves(dataset, bias=None):
+  """
+  Split a dataset into control voltage and power arrays for each channel
+
+  @param dataset : readings from a CalibrationEngine
+  @type  dataset : numpy structured array
+
+  @param bias : use only readings at this bias
+  @type  bias : float
+
+  @return: dict of control voltages, dict of powers, keyed by channel ID
+  """
+  if bias is not None:
+    dataset = dataset[dataset["bias"] == bias]
+  volts = {}
+  powers = {}
+  for chanID in NP.unique(dataset["channel"]):
+    rows = dataset[dataset["channel"] == chanID]
+    rows = rows[NP.argsort(rows["volts"], kind="stable")]
+    volts[str(chanID)] = rows["volts"]
+    powers[str(chanID)] = rows["power"]
+  return volts, powers
+
+def adaptive_volts(measure, vmin, vmax, num_initial=9, tolerance=0.1,
+                   max_points=60, min_step=0.01):
+  """
+  Choose control voltages where they are needed to describe the curves
+
+  Starting from 'num_initial' evenly spaced voltages, the interpolation
+  error of each interval is estimated from the local curvature as::
+    h**2 * max|f''| / 8
+  where f'' comes from the second divided differences at the ends of the
+  interval.  Intervals whose error exceeds 'tolerance' are bisected, worst
+  first, until none remain, the step would be less than 'min_step' or
+  'max_points' have been measured.
+
+  'measure' may return one reading or an array of readings (one for each
+  channel); the worst channel decides.
+
+  @param measure : function which sets a control voltage and returns readings
+  @type  measure : callable
+
+  @param vmin : lowest control voltage
+  @type  vmin : float
+
+  @param vmax : highest control voltage
+  @type  vmax : float
+
+  @param num_initial : number of points in the coarse grid
+  @type  num_initial : int
+
+  @param tolerance : acceptable interpolation error (dB)
+  @type  tolerance : float
+
+  @param max_points : largest number of points to measure
+  @type  max_points : int
+
+  @param min_step : smallest interval (V) to bisect
+  @type  min_step : float
+
+  @return: sorted voltages (1-D array), readings (2-D array, point x channel)
+  """
+  volts = list(NP.linspace(vmin, vmax, num_initial))
+  readings = [NP.atleast_1d(NP.asarray(measure(volt), dtype=float))
+              for volt in volts]
+  while len(volts) < max_points:
+    order = NP.argsort(volts)
+    x = NP.array(volts)[order]
+    y = NP.array(readings)[order]
+    errors = interval_errors(x, y)
+    errors[NP.diff(x) < 2*min_step] = 0
+    worst = NP.argsort(errors)[::-1]
+    worst = worst[errors[worst] > tolerance][:max_points - len(volts)]
+    if len(worst) == 0:
+      break
+    for index in worst:
+      volt = (x[index] + x[index+1])/2
+      volts.append(volt)
+      readings.append(NP.atleast_1d(NP.asarray(measure(volt), dtype=float)))
+  order = NP.argsort(volts)
+  return NP.array(volts)[order], NP.array(readings)[order]
+
+def interval_errors(x, y):
+  """
+  Estimated interpolation error of each interval
+
+  @param x : abscissae in ascending order
+  @type  x : numpy array of float
+
+  @param y : ordinates, shape (len(x),) or (len(x), num_channels)
+  @type  y : numpy array of float
+
+  @return: largest error over the channels for each interval
+  """
+  y = y.reshape(len(x), -1)
+  h = NP.diff(x)
+  if len(x) < 3:
+    return NP.full(len(h), NP.inf)
+  slopes = NP.diff(y, axis=0)/h[:,NP.newaxis]
+  curvature = NP.abs(2*NP.diff(slopes, axis=0)/(h[1:] + h[:-1])[:,NP.newaxis])
+  # each interval uses the curvature at both of its ends
+  curvature = NP.concatenate((curvature[:1], curvature, curvature[-1:]))
+  worst = NP.maximum(curvature[:-1], curvature[1:])
+  return (h[:,NP.newaxis]**2*worst/8).max(axis=1)
+
+def settled_reading(read, tolerance=0.02, num_agree=3, interval=0.05,
+                    max_wait=2.0):
+  """
+  Poll a meter until consecutive readings agree
+
+  The reading is accepted when the last 'num_agree' samples are all within
+  'tolerance' of each other.  If that does not happen within 'max_wait'
+  seconds the last reading is returned and flagged as not settled.
+
+  'read' may return a single value or a sequence of values (e.g. one for each
+  of several power meters); in that case every value must settle.
+
+  @param read : function which returns a reading
+  @type  read : callable
+
+  @param tolerance : largest acceptable spread of the samples (e.g. dB)
+  @type  tolerance : float
+
+  @param num_agree : number of consecutive samples which must agree
+  @type  num_agree : int
+
+  @param interval : time between samples in seconds
+  @type  interval : float
+
+  @param max_wait : longest time to wait in seconds
+  @type  max_wait : float
+
+  @return: (mean of the agreeing samples, settle time in s, settled (bool))
+  """
+  start = time.time()
+  samples = [NP.asarray(read(), dtype=float)]
+  while True:
+    elapsed = time.time() - start
+    if len(samples) >= num_agree:
+      recent = NP.array(samples[-num_agree:])
+      if NP.all(recent.max(axis=0) - recent.min(axis=0) <= tolerance):
+        return _value(recent.mean(axis=0)), elapsed, True
+    if elapsed >= max_wait:
+      module_logger.warning("settled_reading: not settled after %.2f s",
+                            elapsed)
+      return _value(samples[-1]), elapsed, False
+    time.sleep(interval)
+    samples.append(NP.asarray(read(), dtype=float))
+
+def _value(array):
+  """
+  Float for a single reading, numpy array otherwise
+  """
+  if array.ndim == 0:
+    return float(array)
+  return array
@@ -0,0 +1,228 @@
+"""
+Catalog of PIN diode attenuator calibrations
+
+Calibration files are keyed by channel IDs such as 'R1-22-E', which name a
+receiver slot, not the attenuator in it.  When boards are moved the
+calibration has to follow the board's serial number (e.g. '3A').
+
+A CalibrationCatalog keeps calibration files in one directory with an index,
+'index.json', which has a record for each channel of each file::
+  {"id": "12", "calfile": "20240105T101500_wbdc2_data.npz",
+   "chanID": "R1-22-E", "serial": "5A", "date": "2024-01-05T10:15:00",
+   "freq": 22.0, "bias": null, "valid": true, "flags": []}
+'chanID' is the key of the channel in the calibration file.  Records can be
+found by serial number or by slot without searching, and latest() selects the
+newest record which has not been marked invalid.
+
+A PINattenuator given a catalog and a serial number (or slot) takes its
+calibration file and channel from the catalog.
+"""
+import datetime
+import json
+import logging
+import os
+import os.path
+import shutil
+
+module_logger = logging.getLogger(__name__)
+
+class CalibrationCatalog(object):
+  """
+  Calibration files indexed by serial number and receiver slot
+
+  @ivar directory : where the calibration files and index are kept
+  @type directory : str
+
+  @ivar records : all records, keyed by record ID
+  @type records : dict of dicts
+  """
+  index_name = "index.json"
+
+  def __init__(self, directory):
+    """
+    @param directory : catalog directory; created if necessary
+    @type  directory : str
+    """
+    self.directory = directory
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    self.records = {}
+    self.by_serial = {}
+    self.by_slot = {}
+    self._next_id = 0
+    index = os.path.join(directory, self.index_name)
+    if os.path.exists(index):
+      with open(index) as fd:
+        for record in json.load(fd)["records"]:
+          self._insert(record)
+
+  def _insert(self, record):
+    """
+    Put a record in the lookup tables, which are kept in date order
+    """
+    self.records[record["id"]] = record
+    self._next_id = max(self._next_id, int(record["id"]) + 1)
+    for table, key in ((self.by_serial, record["serial"]),
+                       (self.by_slot, record["chanID"])):
+      ids = table.setdefault(key, [])
+      ids.append(record["id"])
+      # usually the newest, so this is already in order
+      if len(ids) > 1 and self.records[ids[-2]]["date"] > record["date"]:
+        ids.sort(key=lambda id: self.records[id]["date"])
+
+  def save(self):
+    """
+    Write the index
+
+    The index is written to a temporary file which then replaces the old one,
+    so a reader never sees a partial index.
+    """
+    index = os.path.join(self.directory, self.index_name)
+    records = sorted(self.records.values(), key=lambda record: int(record["id"]))
+    with open(index+".tmp", "w") as fd:
+      json.dump({"records": records}, fd, indent=1, sort_keys=True)
+    os.replace(index+".tmp", index)
+
+  def add(self, calfile, channels, date=None, flags=None, copy=True,
+          save=True):
+    """
+    Add a calibration file to the catalog
+
+    @param calfile : calibration (.npz) file
+    @type  calfile : str
+
+    @param channels : for each channel ID in calfile, a dict with 'serial' and
+                      optionally 'freq' and 'bias'
+    @type  channels : dict of dicts
+
+    @param date : date of the calibration; default: modification time of calfile
+    @type  date : datetime.datetime instance
+
+    @param flags : quality flags for each channel (see quality.py); flagged
+                   channels are recorded as not valid
+    @type  flags : dict of lists of str
+
+    @param copy : copy the file into the catalog directory
+    @type  copy : bool
+
+    @param save : write the index afterwards
+    @type  save : bool
+
+    @return: list of record IDs
+    """
+    if date is None:
+      date = datetime.datetime.fromtimestamp(os.path.getmtime(calfile))
+    if copy:
+      calfile = self._store(calfile, date)
+    flags = flags or {}
+    ids = []
+    for chanID in sorted(channels):
+      info = channels[chanID]
+      record = {"id": str(self._next_id),
+                "calfile": calfile,
+                "chanID": chanID,
+                "serial": info["serial"],
+                "date": date.isoformat(),
+                "freq": info.get("freq"),
+                "bias": info.get("bias"),
+                "valid": not flags.get(chanID),
+                "flags": list(flags.get(chanID, []))}
+      self._insert(record)
+      ids.append(record["id"])
+    if save:
+      self.save()
+    module_logger.debug("add: %s with %d channels", calfile, len(ids))
+    return ids
+
+  def _store(self, calfile, date):
+    """
+    Copy a file into the catalog directory; returns its name there
+
+    The copy is named by the date and the file's name, with a counter after
+    the date if a copy of that name already exists.
+    """
+    if os.path.dirname(os.path.abspath(calfile)) == \
+                                             os.path.abspath(self.directory):
+      return os.path.basename(calfile)
+    stamp = date.strftime("%Y%m%dT%H%M%S")
+    count = 1
+    while True:
+      name = stamp + ("-%d" % count if count > 1 else "") + "_" + \
+             os.path.basename(calfile)
+      path = os.path.join(self.directory, name)
+      try:
+        # exclusive creation so a concurrent copy cannot take the same name
+        copy = open(path, "xb")
+      except FileExistsError:
+        count += 1
+        continue
+      with copy, open(calfile, "rb") as original:
+        shutil.copyfileobj(original, copy)
+      shutil.copystat(calfile, path)
+      return name
+
+  def add_dataset(self, calfile, dataset, date=None, flags=None, copy=True,
+                  save=True):
+    """
+    Add a calibration file made from a lab data file
+
+    The serial numbers, frequencies and bias voltages are taken from the data.
+
+    @param dataset : the data which were fitted
+    @type  dataset : dataset.CalibrationDataset instance
+    """
+    channels = {}
+    for column, chanID in enumerate(dataset.chanIDs):
+      bias = float(dataset.bias[column])
+      channels[chanID] = {"serial": dataset.serials[column],
+                          "freq": float(dataset.freqs[column]),
+                          "bias": None if bias != bias else bias}
+    return self.add(calfile, channels, date=date, flags=flags, copy=copy,
+                    save=save)
+
+  def _ids(self, serial, slot):
+    if serial is not None:
+      return self.by_serial.get(serial, [])
+    elif slot is not None:
+      return self.by_slot.get(slot, [])
+    raise ValueError("a serial number or slot is required")
+
+  def lookup(self, serial=None, slot=None):
+    """
+    Records for a serial number or a slot (channel ID), oldest first
+    """
+    return [self.records[id] for id in self._ids(serial, slot)]
+
+  def latest(self, serial=None, slot=None, valid=True):
+    """
+    Newest record for a serial number or slot
+
+    @param valid : skip records which are not valid
+    @type  valid : bool
+
+    @return: record (dict) or None
+    """
+    for id in reversed(self._ids(serial, slot)):
+      record = self.records[id]
+      if record["valid"] or not valid:
+        return record
+    return None
+
+  def invalidate(self, record_id, save=True):
+    """
+    Mark a record as not valid, e.g. when the board is found faulty
+    """
+    self.records[record_id]["valid"] = False
+    if save:
+      self.save()
+
+  def resolve(self, serial=None, slot=None):
+    """
+    Calibration file path and channel ID of the latest valid calibration
+
+    @return: (path, chanID)
+    """
+    record = self.latest(serial=serial, slot=slot)
+    if record is None:
+      raise KeyError("no valid calibration for %s" % (serial or slot))
+    return os.path.join(self.directory, record["calfile"]), record["chanID"]
@@ -0,0 +1,143 @@
+"""
+Lab calibration data for PIN diode attenuators
+
+The data are comma-separated files (e.g. apps/wbdc2_data.csv) with::
+  Row 1 - reference (input) power level
+  Row 2 - bias voltage
+  Row 3 - total resistance in control voltage circuit
+  Row 4 - serial number
+  Row 5 - Receiver chain
+  Row 6 - Frequency and polarization of channel
+  Rows 7+ contain the data, with control voltage in column 0.
+Each board has two attenuators, A and B, in adjacent columns, so the serial
+number and receiver are given only in the first column of each pair.
+
+load_dataset() parses a file in one pass and keeps the result in a cache,
+keyed by path and modification time, so loading the same file again is free.
+"""
+import csv
+import logging
+
+import numpy as NP
+
+from Electronics.Instruments.PINatten.cache import FileCache
+
+module_logger = logging.getLogger(__name__)
+
+class CalibrationDataset(object):
+  """
+  Calibration data from one file, indexed by channel ID and serial number
+
+  Array attributes have one entry for each channel (data column)::
+    chanIDs    - channel IDs, e.g. 'R1-18-E'
+    serials    - board serial number and A or B, e.g. '3A'
+    receivers  - receiver chain, e.g. 'R1'
+    freqs      - frequency (GHz)
+    pols       - polarization, e.g. 'E'
+    ref_power  - reference (input) power (dBm)
+    bias       - bias voltage (NaN if not given)
+    resistance - resistance in the control voltage circuit (NaN if not given)
+
+  @ivar volts : control voltages
+  @type volts : numpy array of float
+
+  @ivar power : measured power (dBm), shape (len(volts), num_channels)
+  @type power : numpy array of float
+  """
+  def __init__(self, filename):
+    """
+    @param filename : name of the CSV data file
+    @type  filename : str
+    """
+    self.filename = filename
+    with open(filename) as fd:
+      rows = list(csv.reader(fd))
+    ncols = len(rows[5])
+    header = [row[1:ncols] + [""]*(ncols - len(row)) for row in rows[:6]]
+    data = NP.array([[float(value) for value in row[:ncols]]
+                     for row in rows[6:] if row])
+    self.volts = data[:,0]
+    self.power = data[:,1:]
+    self.ref_power = _floats(header[0])
+    self.bias = _floats(header[1])
+    self.resistance = _floats(header[2])
+    serialnos = _fill(header[3])
+    self.receivers = _fill(header[4])
+    self.freqs = NP.empty(ncols-1)
+    self.pols = []
+    self.chanIDs = []
+    self.serials = []
+    for column, label in enumerate(header[5]):
+      freq, pol = label.split()
+      self.freqs[column] = float(freq)
+      self.pols.append(pol)
+      self.chanIDs.append(self.receivers[column]+'-'+freq+'-'+pol)
+      self.serials.append(serialnos[column] + "AB"[column % 2])
+    # datasets are shared through the cache
+    for array in (self.volts, self.power, self.ref_power, self.bias,
+                  self.resistance, self.freqs):
+      array.flags.writeable = False
+    self.index = dict(zip(self.chanIDs, range(len(self.chanIDs))))
+    self.serial_index = dict(zip(self.serials, range(len(self.serials))))
+
+  @property
+  def gains(self):
+    """
+    Measured power minus the reference power (dB)
+    """
+    return self.power - self.ref_power
+
+  def column(self, key):
+    """
+    Data column for a channel ID or serial number
+    """
+    if key in self.index:
+      return self.index[key]
+    return self.serial_index[key]
+
+  def curve(self, key):
+    """
+    Control voltages and gains for a channel ID or serial number
+    """
+    column = self.column(key)
+    return self.volts, self.power[:,column] - self.ref_power[column]
+
+  def serial(self, chanID):
+    """
+    Board serial number and A or B of a channel
+    """
+    return self.serials[self.index[chanID]]
+
+
+# ---------------------------- module methods ---------------------------------
+
+def _floats(cells):
+  """
+  Numbers from header cells; blank cells are NaN
+  """
+  return NP.array([float(cell) if cell.strip() else NP.nan for cell in cells])
+
+def _fill(cells):
+  """
+  Header cells with blanks filled from the cell to the left
+  """
+  filled = []
+  for cell in cells:
+    filled.append(cell.strip() or (filled[-1] if filled else ""))
+  return filled
+
+dataset_cache = FileCache(CalibrationDataset, maxsize=64)
+
+def load_dataset(filename, reload=False):
+  """
+  Calibration data from a file, cached until the file changes
+
+  @param filename : name of the CSV data file
+  @type  filename : str
+
+  @param reload : parse the file even if the cached copy is current
+  @type  reload : bool
+
+  @return: CalibrationDataset instance
+  """
+  return dataset_cache.get(filename, reload=reload)
@@ -0,0 +1,177 @@
+"""
+Tracking drift of PIN diode attenuator calibrations from live readings
+
+PIN diode curves change with temperature and age.  Whenever an attenuator is
+set and the power after it is read, the measured gain can be compared with
+the gain the calibration predicted.  A DriftTracker fits the differences with
+a straight line in predicted gain::
+  measured - predicted = offset + slope*u
+  u = (predicted - centre)/half_width
+where centre and half_width describe the calibrated gain range, so 'offset'
+and 'slope' are both in dB and the drift at the ends of the range is
+offset -/+ slope.
+
+The fit is recursive least squares with a forgetting factor, so it needs a
+fixed amount of memory and follows slow changes.  A correction can be applied
+when the attenuator is set, and needs_recalibration() tells when the drift is
+too large to be corrected.
+"""
+import logging
+import time
+from collections import deque
+
+import numpy as NP
+
+module_logger = logging.getLogger(__name__)
+
+class DriftTracker(object):
+  """
+  Recursive linear correction of a calibration
+
+  @ivar params : offset and slope of the correction (dB)
+  @type params : numpy array of float
+
+  @ivar count : number of readings used
+  @type count : int
+
+  @ivar history : most recent (time, predicted, measured) readings
+  @type history : collections.deque
+  """
+  def __init__(self, gain_range, forgetting=0.98, prior=1.,
+               drift_limit=0.5, residual_limit=0.3, min_count=10,
+               history=100):
+    """
+    @param gain_range : (lowest, highest) calibrated gain (dB)
+    @type  gain_range : tuple of float
+
+    @param forgetting : weight of the previous fit for each new reading;
+                        readings have an effective memory of
+                        1/(1 - forgetting)
+    @type  forgetting : float
+
+    @param prior : variance (dB^2) of the correction before any readings
+    @type  prior : float
+
+    @param drift_limit : largest acceptable drift (dB) in the gain range
+    @type  drift_limit : float
+
+    @param residual_limit : largest acceptable RMS (dB) of the readings about
+                            the corrected calibration
+    @type  residual_limit : float
+
+    @param min_count : readings needed before recalibration is advised
+    @type  min_count : int
+
+    @param history : number of readings kept for inspection
+    @type  history : int
+    """
+    self.gain_range = (float(min(gain_range)), float(max(gain_range)))
+    self.centre = (self.gain_range[0] + self.gain_range[1])/2.
+    self.half_width = max((self.gain_range[1] - self.gain_range[0])/2., 1e-6)
+    self.forgetting = forgetting
+    self.prior = prior
+    self.drift_limit = drift_limit
+    self.residual_limit = residual_limit
+    self.min_count = min_count
+    self.history = deque(maxlen=history)
+    self.reset()
+
+  def reset(self):
+    """
+    Forget all readings, e.g. after a recalibration
+    """
+    self.params = NP.zeros(2)
+    self._cov = self.prior*NP.eye(2)
+    self.count = 0
+    self._weight = 0.
+    self._mean = 0.
+    self._mean_square = 0.
+    self.history.clear()
+
+  def _basis(self, predicted):
+    return NP.array([1., (predicted - self.centre)/self.half_width])
+
+  def correction(self, predicted):
+    """
+    Expected measured minus predicted gain (dB)
+    """
+    predicted = NP.asarray(predicted, dtype=float)
+    return self.params[0] + \
+           self.params[1]*(predicted - self.centre)/self.half_width
+
+  def update(self, predicted, measured):
+    """
+    Fold in one reading
+
+    @param predicted : gain (dB) the calibration gives for the control voltage
+    @type  predicted : float
+
+    @param measured : gain (dB) measured at that voltage
+    @type  measured : float
+
+    @return: residual (dB) of the reading before the update
+    """
+    predicted = float(predicted)
+    measured = float(measured)
+    phi = self._basis(predicted)
+    residual = measured - predicted - phi.dot(self.params)
+    P_phi = self._cov.dot(phi)
+    gain = P_phi/(self.forgetting + phi.dot(P_phi))
+    self.params = self.params + gain*residual
+    self._cov = (self._cov - NP.outer(gain, P_phi))/self.forgetting
+    # readings at only one setting let the covariance grow without limit
+    trace = NP.trace(self._cov)
+    if trace > 2*self.prior:
+      self._cov *= 2*self.prior/trace
+    # exponentially weighted residual statistics
+    self._weight = self.forgetting*self._weight + 1.
+    self._mean += (residual - self._mean)/self._weight
+    self._mean_square += (residual**2 - self._mean_square)/self._weight
+    self.count += 1
+    self.history.append((time.time(), predicted, measured))
+    module_logger.debug("update: %f dB predicted, %f dB measured; residual %f",
+                        predicted, measured, residual)
+    return residual
+
+  def request(self, gain):
+    """
+    Calibrated gain to request so that the attenuator gives 'gain'
+
+    This solves predicted + correction(predicted) = gain.
+    """
+    scale = 1. + self.params[1]/self.half_width
+    return (gain - self.params[0]
+            + self.params[1]*self.centre/self.half_width)/scale
+
+  def drift(self):
+    """
+    Largest correction (dB) in the calibrated gain range
+    """
+    return float(abs(self.params[0]) + abs(self.params[1]))
+
+  def residual_rms(self):
+    """
+    Weighted RMS (dB) of the recent readings about the corrected calibration
+    """
+    return float(NP.sqrt(self._mean_square))
+
+  def needs_recalibration(self):
+    """
+    True when the drift or the scatter of the readings is too large
+    """
+    if self.count < self.min_count:
+      return False
+    return self.drift() > self.drift_limit or \
+           self.residual_rms() > self.residual_limit
+
+  def statistics(self):
+    """
+    Drift statistics as a dict
+    """
+    return {"count": self.count,
+            "offset": float(self.params[0]),
+            "slope": float(self.params[1]),
+            "drift": self.drift(),
+            "residual_mean": float(self._mean),
+            "residual_rms": self.residual_rms(),
+            "recalibrate": self.needs_recalibration()}
@@ -0,0 +1,328 @@
+"""
+Monotone calibration model for PIN diode attenuators
+
+The calibration apps used to fit two independent cubic splines, gain as a
+function of control voltage and control voltage as a function of gain.  They
+were not inverses of each other and could overshoot between data points.
+
+An AttenuatorModel fits one monotone piecewise cubic Hermite (PCHIP) curve of
+gain against control voltage.  The inverse is evaluated from a table of the
+forward curve followed by Newton steps on the same curve, so::
+  model(model.inverse(gain)) == gain
+to rounding error.  Derivatives are computed analytically from the cubic
+coefficients.
+"""
+import logging
+from collections.abc import Mapping
+
+import numpy as NP
+
+from Electronics.Instruments.PINatten.calfile import (PiecewiseCubic,
+                                                     SplineTable)
+
+module_logger = logging.getLogger(__name__)
+
+class AttenuatorModel(object):
+  """
+  Gain of an attenuator as a monotone function of control voltage
+
+  @ivar curve : gain (dB) as a function of control voltage (V)
+  @type curve : calfile.PiecewiseCubic instance
+
+  @ivar volts_range : (lowest, highest) control voltage
+  @type volts_range : tuple of float
+
+  @ivar gain_range : (lowest, highest) gain
+  @type gain_range : tuple of float
+  """
+  def __init__(self, curve, num_inverse=512):
+    """
+    @param curve : monotone gain curve
+    @type  curve : calfile.PiecewiseCubic instance
+
+    @param num_inverse : number of points in the inverse table
+    @type  num_inverse : int
+    """
+    self.curve = curve
+    self.volts_range = (float(curve.x[0]), float(curve.x[-1]))
+    volts = NP.linspace(self.volts_range[0], self.volts_range[1], num_inverse)
+    gains = curve(volts)
+    if gains[-1] < gains[0]:
+      volts = volts[::-1]
+      gains = gains[::-1]
+    # rounding can leave tiny reversals which np.interp does not allow
+    self._inv_gains = NP.maximum.accumulate(gains)
+    self._inv_volts = volts
+    self.gain_range = (float(self._inv_gains[0]), float(self._inv_gains[-1]))
+
+  @classmethod
+  def fit(cls, volts, gain, num_inverse=512):
+    """
+    Fit a model to measured gain at a set of control voltages
+
+    Data which are not monotone are first replaced by the nearest monotone
+    sequence (in the least squares sense).
+
+    @param volts : control voltages
+    @type  volts : numpy array of float
+
+    @param gain : measured gain (or negative attenuation) in dB
+    @type  gain : numpy array of float
+    """
+    return cls(pchip(volts, gain, monotone=True), num_inverse=num_inverse)
+
+  def __call__(self, volts):
+    """
+    Gain at the given control voltages
+    """
+    return self.curve(volts)
+
+  def derivative(self, volts):
+    """
+    Slope of the gain curve (dB/V)
+    """
+    return self.curve.derivative(volts)
+
+  def inverse(self, gain, iterations=2):
+    """
+    Control voltages which give the requested gain
+
+    @param gain : requested gain in dB
+    @type  gain : float or numpy array of float
+
+    @param iterations : number of Newton steps after table lookup
+    @type  iterations : int
+    """
+    gain = NP.asarray(gain, dtype=float)
+    if NP.any((gain < self.gain_range[0]) | (gain > self.gain_range[1])):
+      raise ValueError("A value in x_new is out of the interpolation range.")
+    volts = NP.interp(gain, self._inv_gains, self._inv_volts)
+    vmin, vmax = self.volts_range
+    for count in range(iterations):
+      slope = self.curve.derivative(volts)
+      step = NP.where(slope != 0,
+                      (self.curve(volts) - gain)/NP.where(slope != 0, slope, 1),
+                      0)
+      volts = NP.clip(volts - step, vmin, vmax)
+    return volts
+
+
+class ModelTable(Mapping):
+  """
+  Monotone models for the channels of a calfile.SplineTable
+
+  Models are created when first used.
+  """
+  def __init__(self, table):
+    """
+    @param table : forward (gain vs. control voltage) curves
+    @type  table : calfile.SplineTable instance
+    """
+    self.table = table
+    self._models = {}
+
+  def __getitem__(self, chanID):
+    if chanID not in self._models:
+      self._models[chanID] = AttenuatorModel(self.table[chanID])
+    return self._models[chanID]
+
+  def __iter__(self):
+    return iter(self.table)
+
+  def __len__(self):
+    return len(self.table)
+
+
+class InverseTable(Mapping):
+  """
+  Control voltage functions for the channels of a ModelTable
+
+  This takes the place of the control voltage splines of older calibration
+  files; indexing gives the 'inverse' method of each model.
+  """
+  def __init__(self, models):
+    self.models = models
+
+  def __getitem__(self, chanID):
+    return self.models[chanID].inverse
+
+  def __iter__(self):
+    return iter(self.models)
+
+  def __len__(self):
+    return len(self.models)
+
+
+# ---------------------------- module methods ---------------------------------
+
+def pchip(x, y, monotone=False):
+  """
+  Piecewise cubic Hermite interpolating polynomial
+
+  This uses the same slopes as scipy.interpolate.PchipInterpolator so the
+  curve is monotone wherever the data are.
+
+  @param x : abscissae; they will be sorted into ascending order
+  @type  x : numpy array of float
+
+  @param y : ordinates
+  @type  y : numpy array of float
+
+  @param monotone : first make y monotone if it is not
+  @type  monotone : bool
+
+  @return: calfile.PiecewiseCubic instance
+  """
+  x = NP.asarray(x, dtype=float)
+  y = NP.asarray(y, dtype=float)
+  order = NP.argsort(x)
+  x = x[order]
+  y = y[order]
+  if monotone:
+    y = monotone_fit(y)
+  return PiecewiseCubic(x, pchip_coefs(x, y))
+
+def pchip_batch(x, y, channels=None, monotone=False):
+  """
+  Fit PCHIP curves to all the columns of a data matrix at once
+
+  @param x : abscissae, distinct down each column, which are sorted into
+             ascending order; one column shared by all channels or one for
+             each
+  @type  x : numpy array of float, shape (num_points,) or (num_points, num_chans)
+
+  @param y : ordinates, one column for each channel
+  @type  y : numpy array of float, shape (num_points, num_chans)
+
+  @param channels : channel IDs; default: column numbers
+  @type  channels : list of str
+
+  @param monotone : first make non-monotone columns monotone
+  @type  monotone : bool
+
+  @return: calfile.SplineTable instance
+  """
+  y = NP.array(y, dtype=float)
+  x = NP.broadcast_to(NP.asarray(x, dtype=float).reshape(len(y), -1), y.shape)
+  if NP.any(NP.diff(x, axis=0) < 0):
+    order = NP.argsort(x, axis=0, kind="stable")
+    x = NP.take_along_axis(x, order, axis=0)
+    y = NP.take_along_axis(y, order, axis=0)
+  if monotone:
+    # only the columns which need it are adjusted
+    steps = NP.diff(y, axis=0)*NP.sign(y[-1] - y[0])
+    for column in NP.nonzero(NP.any(steps < 0, axis=0))[0]:
+      y[:,column] = monotone_fit(y[:,column])
+  coefs = pchip_coefs(x, y)
+  if channels is None:
+    channels = [str(column) for column in range(y.shape[1])]
+  return SplineTable(channels, NP.ascontiguousarray(x.T),
+                     NP.ascontiguousarray(coefs.transpose(2,0,1)),
+                     NP.full(y.shape[1], len(y)))
+
+def pchip_coefs(x, y):
+  """
+  PCHIP polynomial coefficients for each interval
+
+  Any dimensions after the first are treated as separate curves.
+
+  @return: numpy array, shape (4, len(x)-1, ...), highest power first
+  """
+  h = NP.diff(x, axis=0)
+  h = h.reshape(h.shape + (1,)*(y.ndim - h.ndim))
+  delta = NP.diff(y, axis=0)/h
+  slopes = pchip_slopes(h, delta)
+  coefs = NP.empty((4,) + delta.shape)
+  coefs[0] = (slopes[:-1] + slopes[1:] - 2*delta)/h**2
+  coefs[1] = (3*delta - 2*slopes[:-1] - slopes[1:])/h
+  coefs[2] = slopes[:-1]
+  coefs[3] = y[:-1]
+  return coefs
+
+def pchip_slopes(h, delta):
+  """
+  Weighted harmonic mean slopes at the data points, as in scipy's PCHIP
+
+  Any dimensions after the first are treated as separate curves.
+
+  @param h : interval widths
+  @type  h : numpy array of float
+
+  @param delta : secant slopes of the intervals
+  @type  delta : numpy array of float
+  """
+  slopes = NP.zeros((len(delta)+1,) + delta.shape[1:])
+  if len(delta) == 1:
+    slopes[:] = delta[0]
+    return slopes
+  w1 = 2*h[1:] + h[:-1]
+  w2 = h[1:] + 2*h[:-1]
+  same_sign = delta[:-1]*delta[1:] > 0
+  with NP.errstate(divide='ignore', invalid='ignore'):
+    harmonic = (w1 + w2)/(w1/delta[:-1] + w2/delta[1:])
+  slopes[1:-1] = NP.where(same_sign, harmonic, 0)
+  slopes[0] = _edge_slope(h[0], h[1], delta[0], delta[1])
+  slopes[-1] = _edge_slope(h[-1], h[-2], delta[-1], delta[-2])
+  return slopes
+
+def _edge_slope(h0, h1, m0, m1):
+  """
+  One-sided three-point slope at an end, limited to keep the end monotone
+  """
+  d = ((2*h0 + h1)*m0 - h0*m1)/(h0 + h1)
+  d = NP.where(NP.sign(d) != NP.sign(m0), 0., d)
+  return NP.where((NP.sign(m0) != NP.sign(m1)) & (NP.abs(d) > NP.abs(3*m0)),
+                  3*m0, d)
+
+def monotone_fit(y):
+  """
+  Nearest monotone sequence by the pool-adjacent-violators algorithm
+
+  The direction is that of the overall trend from y[0] to y[-1].
+  """
+  y = NP.asarray(y, dtype=float)
+  sign = -1. if y[-1] < y[0] else 1.
+  values = []
+  weights = []
+  for value in sign*y:
+    values.append(value)
+    weights.append(1)
+    while len(values) > 1 and values[-2] > values[-1]:
+      weight = weights[-2] + weights[-1]
+      value = (values[-2]*weights[-2] + values[-1]*weights[-1])/weight
+      values[-2:] = [value]
+      weights[-2:] = [weight]
+  result = sign*NP.repeat(values, weights)
+  changed = NP.count_nonzero(result != y)
+  if changed:
+    module_logger.warning("monotone_fit: adjusted %d non-monotone points",
+                          changed)
+  return result
+
+def fit_models(x, y, indices):
+  """
+  Fit monotone models to a set of channels
+
+  This replaces fitting two splines with get_splines() in the apps.  The
+  channels are fitted together with pchip_batch() if they have the same
+  number of points, and one at a time otherwise.
+
+  @param x : control voltages
+  @type  x : dict of numpy arrays of float
+
+  @param y : gains (attenuation data re-zeroed)
+  @type  y : dict of numpy arrays of float
+
+  @param indices : keys of the X and Y arrays to be fitted
+  @type  indices : list of str
+
+  @return: dict of AttenuatorModel instances
+  """
+  indices = list(indices)
+  if len(set(len(y[index]) for index in indices)) > 1:
+    return dict((index, AttenuatorModel.fit(x[index], y[index]))
+                for index in indices)
+  columns = NP.array([y[index] for index in indices]).T
+  abscissae = NP.array([x[index] for index in indices]).T
+  table = pchip_batch(abscissae, columns, channels=indices, monotone=True)
+  return dict(ModelTable(table))
@@ -0,0 +1,278 @@
+"""
+Batch calibration of PIN diode attenuators from lab data files
+
+This does what apps/interp_att.py does interactively, for any number of data
+files and without operator input.  For each CSV data file (see dataset.py)::
+  load     - parse the file
+  re-zero  - gains are the powers minus the reference powers in the file
+             header ("reference") or minus the first reading ("first")
+  fit      - monotone models for all channels with model.pchip_batch()
+  verify   - quality.channel_quality() for every channel
+  emit     - <stem>.npz calibration file (calfile format), <stem>-quality.json
+             and, unless disabled, <stem>-data.png, <stem>-fit.png and
+             <stem>-slope.png rendered with the Agg backend
+Files are processed in a pool of worker processes.  From the shell::
+  python pipeline.py -o caldir data1.csv data2.csv ...
+"""
+import argparse
+import json
+import logging
+import math
+import os.path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as NP
+
+from Electronics.Instruments.PINatten.calfile import save_calibration
+from Electronics.Instruments.PINatten.catalog import CalibrationCatalog
+from Electronics.Instruments.PINatten.dataset import load_dataset
+from Electronics.Instruments.PINatten.model import ModelTable, pchip_batch
+from Electronics.Instruments.PINatten.quality import (THRESHOLDS,
+                                                      channel_quality)
+
+module_logger = logging.getLogger(__name__)
+
+def rezero(dataset, mode="reference"):
+  """
+  Gains for all channels of a dataset
+
+  @param dataset : calibration data
+  @type  dataset : dataset.CalibrationDataset instance
+
+  @param mode : "reference" or "first"
+  @type  mode : str
+
+  @return: numpy array of float, shape (num_points, num_channels)
+  """
+  if mode == "reference":
+    return dataset.gains
+  elif mode == "first":
+    return dataset.power - dataset.power[0]
+  raise ValueError("re-zero mode must be 'reference' or 'first'")
+
+def sampling_points(vmin, vmax, vstep=None):
+  """
+  Sampling range (start, stop, step) on round numbers within (vmin, vmax)
+
+  @param vmin : minimum abscissa
+  @type  vmin : float
+
+  @param vmax : maximum abscissa
+  @type  vmax : float
+
+  @param vstep : step size; default: a power of ten near (vmax-vmin)/100
+  @type  vstep : float or None
+
+  @return: tuple of float
+  """
+  if vstep is None:
+    vstep = 10.**math.floor(math.log10(abs(float(vmax) - float(vmin))/100.))
+  i_start = int(vmin/vstep)
+  i_stop = int(vmax/vstep)
+  if i_stop > i_start:
+    if i_start*vstep < vmin:
+      i_start += 1
+    if i_stop*vstep > vmax:
+      i_stop -= 1
+    return i_start*vstep, i_stop*vstep, vstep
+  else:
+    if i_stop*vstep < vmax:
+      i_stop += 1
+    return i_start*vstep, i_stop*vstep, -vstep
+
+def calibrate_file(filename, outdir=".", mode="reference", plots=True,
+                   thresholds=THRESHOLDS):
+  """
+  Calibrate all the channels in one data file
+
+  @param filename : CSV data file
+  @type  filename : str
+
+  @param outdir : directory for the calibration file, report and figures
+  @type  outdir : str
+
+  @param mode : re-zero mode; see rezero()
+  @type  mode : str
+
+  @param plots : render figures
+  @type  plots : bool
+
+  @param thresholds : largest acceptable errors; see quality.THRESHOLDS
+  @type  thresholds : dict of float
+
+  @return: dict summarizing the results
+  """
+  stem = os.path.join(outdir,
+                      os.path.splitext(os.path.basename(filename))[0])
+  dataset = load_dataset(filename)
+  gains = rezero(dataset, mode)
+  table = pchip_batch(dataset.volts, gains, channels=dataset.chanIDs,
+                      monotone=True)
+  models = ModelTable(table)
+  V_sample_range = {}
+  att_sample_range = {}
+  quality = {}
+  for column, chanID in enumerate(dataset.chanIDs):
+    V_sample_range[chanID] = sampling_points(*models[chanID].volts_range)
+    att_sample_range[chanID] = sampling_points(*models[chanID].gain_range)
+    quality[chanID] = channel_quality(dataset.volts, gains[:,column],
+                                      thresholds)
+    quality[chanID]["serial"] = dataset.serials[column]
+  calfile = stem+".npz"
+  save_calibration(calfile, (models, V_sample_range), (None, att_sample_range))
+  with open(stem+"-quality.json", "w") as fd:
+    json.dump(quality, fd, indent=1, sort_keys=True)
+  figures = plot_calibration(dataset, gains, table, stem) if plots else []
+  flagged = dict((chanID, quality[chanID]["flags"]) for chanID in quality
+                 if quality[chanID]["flags"])
+  for chanID in flagged:
+    module_logger.warning("calibrate_file: %s %s flagged %s",
+                          filename, chanID, flagged[chanID])
+  return {"filename": filename,
+          "calfile": calfile,
+          "report": stem+"-quality.json",
+          "figures": figures,
+          "channels": len(dataset.chanIDs),
+          "flagged": flagged}
+
+def _calibrate_task(task):
+  """
+  Worker process task
+  """
+  filename, kwargs = task
+  return calibrate_file(filename, **kwargs)
+
+def run_pipeline(filenames, outdir=".", processes=None, catalog=None,
+                 **kwargs):
+  """
+  Calibrate many data files in a pool of processes
+
+  Keyword arguments are passed to calibrate_file().  A summary of all the
+  files is written to 'summary.json' in outdir.  If a catalog directory is
+  given the calibration files are added to it, with flagged channels marked
+  as not valid.
+
+  @param filenames : CSV data files
+  @type  filenames : list of str
+
+  @param outdir : directory for the results
+  @type  outdir : str
+
+  @param processes : number of worker processes; default: number of CPUs
+  @type  processes : int
+
+  @param catalog : catalog directory; see catalog.py
+  @type  catalog : str
+
+  @return: list of dicts from calibrate_file()
+  """
+  if not os.path.isdir(outdir):
+    os.makedirs(outdir)
+  kwargs["outdir"] = outdir
+  tasks = [(filename, kwargs) for filename in filenames]
+  with ProcessPoolExecutor(max_workers=processes) as pool:
+    summary = list(pool.map(_calibrate_task, tasks))
+  if catalog:
+    # only this process writes the index
+    catalog = CalibrationCatalog(catalog)
+    for result in summary:
+      result["records"] = catalog.add_dataset(result["calfile"],
+                                              load_dataset(result["filename"]),
+                                              flags=result["flagged"],
+                                              save=False)
+    catalog.save()
+  with open(os.path.join(outdir, "summary.json"), "w") as fd:
+    json.dump(summary, fd, indent=1, sort_keys=True)
+  return summary
+
+#----------------------- functions for plotting results -----------------------
+
+colors = ['b','g','r','c','m','y','k']
+
+def column_marker(column):
+  """
+  Unique markers modulo 7
+  """
+  return 'x+d'[min(column//7, 2)]
+
+def plot_calibration(dataset, gains, table, stem, num_points=200):
+  """
+  Render the data, fits and slopes to PNG files without a display
+
+  @return: list of file names
+  """
+  # imported here so the pipeline can run where matplotlib is not installed
+  from matplotlib.backends.backend_agg import FigureCanvasAgg
+  from matplotlib.figure import Figure
+
+  volts = NP.linspace(dataset.volts.min(), dataset.volts.max(), num_points)
+  fitted = table.evaluate(volts)
+  slopes = table.evaluate(volts, nu=1)
+  filenames = []
+  for name, ylabel in [("data", 'Insertion Loss (dB)'),
+                       ("fit", 'Insertion Loss (dB)'),
+                       ("slope", 'Insertion Loss Gradient (dB/V)')]:
+    fig = Figure(figsize=(8,6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    for column, chanID in enumerate(dataset.chanIDs):
+      color = colors[column % 7]
+      marker = column_marker(column)
+      if name == "data":
+        ax.plot(dataset.volts, gains[:,column], color=color, marker=marker,
+                ls='-', label=chanID)
+      elif name == "fit":
+        ax.plot(dataset.volts, gains[:,column], color=color, marker=marker,
+                ls='', label=chanID)
+        ax.plot(volts, fitted[column], color=color, ls='-')
+      else:
+        ax.plot(volts, slopes[column], color=color, ls='-', label=chanID)
+    ax.grid()
+    ax.set_xlabel('Control Volts (V)')
+    ax.set_ylabel(ylabel)
+    ax.set_title({"data":  "Attenuation Curves",
+                  "fit":   'Monotone (PCHIP) interpolation on dB',
+                  "slope": 'Attenuation interpolation'}[name])
+    ax.legend(loc='lower left', numpoints=1, fontsize='x-small', ncol=2)
+    filename = "%s-%s.png" % (stem, name)
+    fig.savefig(filename)
+    filenames.append(filename)
+  return filenames
+
+#------------------------------ command line ----------------------------------
+
+def main(argv=None):
+  """
+  Command line interface; returns 1 if any channel was flagged
+  """
+  parser = argparse.ArgumentParser(
+                      description="Calibrate PIN diode attenuators from data files")
+  parser.add_argument("filenames", nargs="+", help="CSV data files")
+  parser.add_argument("-o", "--outdir", default=".",
+                      help="directory for results (default: .)")
+  parser.add_argument("-j", "--processes", type=int, default=None,
+                      help="number of worker processes (default: CPUs)")
+  parser.add_argument("--rezero", choices=["reference", "first"],
+                      default="reference",
+                      help="subtract the header reference power or the "
+                           "first reading (default: reference)")
+  parser.add_argument("--catalog", default=None,
+                      help="add the calibrations to this catalog directory")
+  parser.add_argument("--no-plots", action="store_true",
+                      help="do not render figures")
+  parser.add_argument("-v", "--verbose", action="store_true")
+  args = parser.parse_args(argv)
+  logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+  summary = run_pipeline(args.filenames, outdir=args.outdir,
+                         processes=args.processes, catalog=args.catalog,
+                         mode=args.rezero,
+                         plots=not args.no_plots)
+  for result in summary:
+    module_logger.info("%s: %d channels, %d flagged -> %s",
+                       result["filename"], result["channels"],
+                       len(result["flagged"]), result["calfile"])
+  return 1 if any(result["flagged"] for result in summary) else 0
+
+if __name__ == "__main__":
+  import sys
+  sys.exit(main())
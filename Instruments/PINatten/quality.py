@@ -0,0 +1,160 @@
+"""
+Calibration quality checks for PIN diode attenuators
+
+For each channel of a calibration data file this computes::
+  loo         - leave-one-out residuals: each interior point is predicted by
+                a curve fitted without it
+  holdout     - residuals of the odd-numbered points predicted from a curve
+                fitted to the even-numbered ones
+  monotone    - whether the measured gains are monotone, and how many steps
+                go the wrong way
+  inversion   - worst |forward(inverse(gain)) - gain| over the gain range, for
+                the monotone model and for the old pair of independent cubic
+                splines
+and flags anything beyond the given thresholds.
+
+Channels (and files) are independent so they are checked in a pool of worker
+processes.  The report is a dict which can be saved as JSON::
+  {filename: {chanID: {"loo_max": ..., "flags": [...], ...}, ...}, ...}
+"""
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as NP
+
+from Electronics.Instruments.PINatten.calfile import fit_cubic
+from Electronics.Instruments.PINatten.dataset import load_dataset
+from Electronics.Instruments.PINatten.model import AttenuatorModel, pchip_batch
+
+module_logger = logging.getLogger(__name__)
+
+THRESHOLDS = {"loo":       0.5,   # dB
+              "holdout":   0.5,   # dB
+              "inversion": 0.01}  # dB
+
+def channel_quality(volts, gains, thresholds=THRESHOLDS, num_inverse=200):
+  """
+  Quality measures for one channel
+
+  @param volts : control voltages, ascending
+  @type  volts : numpy array of float
+
+  @param gains : measured gains (dB)
+  @type  gains : numpy array of float
+
+  @param thresholds : largest acceptable errors, as in THRESHOLDS
+  @type  thresholds : dict of float
+
+  @param num_inverse : number of gains at which inversion is checked
+  @type  num_inverse : int
+
+  @return: dict of JSON-compatible values
+  """
+  volts = NP.asarray(volts, dtype=float)
+  gains = NP.asarray(gains, dtype=float)
+  steps = NP.diff(gains)*NP.sign(gains[-1] - gains[0])
+  report = {"num_points": len(volts),
+            "monotone": bool(NP.all(steps >= 0)),
+            "reversals": int(NP.count_nonzero(steps < 0))}
+  # leave-one-out: curve k of the batch omits interior point k+1; each
+  # curve is made monotone using only its own training points
+  num = len(volts)
+  keep = ~NP.eye(num, dtype=bool)[1:-1]
+  x = NP.broadcast_to(volts, keep.shape)[keep].reshape(num-2, num-1)
+  y = NP.broadcast_to(gains, keep.shape)[keep].reshape(num-2, num-1)
+  predicted = pchip_batch(x.T, y.T, monotone=True).evaluate(
+                                           volts[1:-1][:,NP.newaxis])[:,0]
+  loo = predicted - gains[1:-1]
+  # holdout: fit the even points (and the last) and predict the odd ones
+  train = NP.zeros(num, dtype=bool)
+  train[::2] = True
+  train[-1] = True
+  table = pchip_batch(volts[train], gains[train][:,NP.newaxis], monotone=True)
+  holdout = table.evaluate(volts[~train])[0] - gains[~train]
+  report["loo_rms"] = float(NP.sqrt(NP.mean(loo**2)))
+  report["loo_max"] = float(NP.abs(loo).max())
+  report["loo_worst_volts"] = float(volts[1:-1][NP.argmax(NP.abs(loo))])
+  report["holdout_rms"] = float(NP.sqrt(NP.mean(holdout**2)))
+  report["holdout_max"] = float(NP.abs(holdout).max())
+  # inversion
+  model = AttenuatorModel.fit(volts, gains)
+  test_gains = NP.linspace(model.gain_range[0], model.gain_range[1],
+                           num_inverse)
+  report["model_inversion"] = float(
+                         NP.abs(model(model.inverse(test_gains)) - test_gains).max())
+  report["spline_inversion"] = _spline_inversion(volts, gains, test_gains)
+  flags = []
+  if not report["monotone"]:
+    flags.append("non-monotone")
+  if report["loo_max"] > thresholds["loo"]:
+    flags.append("loo")
+  if report["holdout_max"] > thresholds["holdout"]:
+    flags.append("holdout")
+  if report["model_inversion"] > thresholds["inversion"]:
+    flags.append("inversion")
+  report["flags"] = flags
+  return report
+
+def _spline_inversion(volts, gains, test_gains):
+  """
+  Inversion error of independent forward and inverse cubic splines
+
+  This is what the old two-spline calibration files would do.  Returns None
+  if the gains have repeated values, so no inverse spline can be fitted.
+  """
+  if len(NP.unique(gains)) < len(gains):
+    return None
+  forward = fit_cubic(volts, gains)
+  inverse = fit_cubic(gains, volts)
+  lower = max(test_gains[0], gains.min())
+  upper = min(test_gains[-1], gains.max())
+  test_gains = test_gains[(test_gains >= lower) & (test_gains <= upper)]
+  test_volts = NP.clip(inverse(test_gains), volts.min(), volts.max())
+  return float(NP.abs(forward(test_volts) - test_gains).max())
+
+def _check_channel(task):
+  """
+  Worker process task: quality of one channel of one file
+  """
+  filename, chanID, thresholds = task
+  dataset = load_dataset(filename)
+  volts, gains = dataset.curve(chanID)
+  report = channel_quality(volts, gains, thresholds)
+  report["serial"] = dataset.serial(chanID)
+  return filename, chanID, report
+
+def quality_report(filenames, thresholds=THRESHOLDS, processes=None):
+  """
+  Check every channel of every file in a pool of processes
+
+  @param filenames : calibration data files
+  @type  filenames : list of str
+
+  @param thresholds : largest acceptable errors, as in THRESHOLDS
+  @type  thresholds : dict of float
+
+  @param processes : number of worker processes; default: number of CPUs
+  @type  processes : int
+
+  @return: dict of dicts of channel reports, keyed by file and channel ID
+  """
+  tasks = [(filename, chanID, thresholds)
+           for filename in filenames
+           for chanID in load_dataset(filename).chanIDs]
+  report = dict((filename, {}) for filename in filenames)
+  with ProcessPoolExecutor(max_workers=processes) as pool:
+    for filename, chanID, result in pool.map(_check_channel, tasks,
+                                             chunksize=8):
+      report[filename][chanID] = result
+      if result["flags"]:
+        module_logger.warning("quality_report: %s %s flagged %s",
+                              filename, chanID, result["flags"])
+  return report
+
+def write_report(report, filename):
+  """
+  Save a quality report as JSON
+  """
+  with open(filename, "w") as fd:
+    json.dump(report, fd, indent=1, sort_keys=True)
@@ -0,0 +1,180 @@
+"""
+Frequency-dependent calibration of PIN diode attenuators
+
+The lab data (e.g. apps/wbdc2_data.csv) have an attenuation curve for each
+receiver and polarization at several frequencies (18, 20, 22, 24 and 26 GHz).
+A CalibrationSurface holds the curves for one receiver and polarization as a
+grid of gain against (frequency, control voltage).
+
+Two kinds of interpolation are provided::
+  linear - bilinear in frequency and control voltage
+  cubic  - monotone cubic (PCHIP) in control voltage, linear in frequency
+Since a linear blend of two curves which fall with voltage also falls with
+voltage, the cubic surface is monotone in voltage at every frequency and can be
+inverted to set an attenuation at any frequency in the band.
+"""
+import logging
+from collections import OrderedDict
+
+import numpy as NP
+
+from Electronics.Instruments.PINatten.calfile import PiecewiseCubic
+from Electronics.Instruments.PINatten.dataset import load_dataset
+from Electronics.Instruments.PINatten.model import (AttenuatorModel,
+                                                    monotone_fit, pchip_coefs)
+
+module_logger = logging.getLogger(__name__)
+
+class CalibrationSurface(object):
+  """
+  Gain as a function of frequency and control voltage
+
+  @ivar freqs : frequencies of the calibration curves, ascending
+  @type freqs : numpy array of float
+
+  @ivar volts : control voltages, ascending
+  @type volts : numpy array of float
+
+  @ivar gains : gain (dB) with shape (len(freqs), len(volts))
+  @type gains : numpy array of float
+  """
+  def __init__(self, freqs, volts, gains, kind="cubic", max_models=32):
+    """
+    @param freqs : frequencies of the calibration curves
+    @type  freqs : list or numpy array of float
+
+    @param volts : control voltages at which the gains were measured
+    @type  volts : list or numpy array of float
+
+    @param gains : gains, one row for each frequency
+    @type  gains : 2-D numpy array of float
+
+    @param kind : "cubic" or "linear"
+    @type  kind : str
+
+    @param max_models : number of models kept by model(); the least recently
+                        used are dropped
+    @type  max_models : int
+    """
+    freqs = NP.asarray(freqs, dtype=float)
+    volts = NP.asarray(volts, dtype=float)
+    gains = NP.asarray(gains, dtype=float)
+    forder = NP.argsort(freqs)
+    vorder = NP.argsort(volts)
+    self.freqs = freqs[forder]
+    self.volts = volts[vorder]
+    self.gains = NP.array([monotone_fit(row) for row in gains[forder][:,vorder]])
+    self.kind = kind
+    # PCHIP coefficients for each frequency share the voltage breakpoints
+    self.coefs = pchip_coefs(self.volts, self.gains.T).transpose(2,0,1)
+    self.max_models = max_models
+    self._models = OrderedDict()
+
+  def _freq_index(self, freq):
+    """
+    Interval index and fractional position for each frequency
+    """
+    freq = NP.asarray(freq, dtype=float)
+    if NP.any((freq < self.freqs[0]) | (freq > self.freqs[-1])):
+      raise ValueError("frequency outside %s-%s" % (self.freqs[0],
+                                                     self.freqs[-1]))
+    if len(self.freqs) == 1:
+      return NP.zeros(freq.shape, dtype=int), NP.zeros(freq.shape), 0
+    index = NP.clip(NP.searchsorted(self.freqs, freq, side='right') - 1,
+                    0, len(self.freqs)-2)
+    frac = (freq - self.freqs[index])/(self.freqs[index+1] - self.freqs[index])
+    return index, frac, 1
+
+  def __call__(self, freq, volts):
+    """
+    Gain at the given frequencies and control voltages
+
+    The arguments are broadcast against each other.
+    """
+    freq, volts = NP.broadcast_arrays(NP.asarray(freq, dtype=float),
+                                      NP.asarray(volts, dtype=float))
+    if NP.any((volts < self.volts[0]) | (volts > self.volts[-1])):
+      raise ValueError("control voltage outside %s-%s" % (self.volts[0],
+                                                           self.volts[-1]))
+    fi, ft, step = self._freq_index(freq)
+    vi = NP.clip(NP.searchsorted(self.volts, volts, side='right') - 1,
+                 0, len(self.volts)-2)
+    dv = volts - self.volts[vi]
+    if self.kind == "linear":
+      vt = dv/(self.volts[vi+1] - self.volts[vi])
+      lower = (1-vt)*self.gains[fi,vi] + vt*self.gains[fi,vi+1]
+      upper = (1-vt)*self.gains[fi+step,vi] + vt*self.gains[fi+step,vi+1]
+    else:
+      lower = self._horner(fi, vi, dv)
+      upper = self._horner(fi+step, vi, dv)
+    return (1-ft)*lower + ft*upper
+
+  def _horner(self, fi, vi, dv):
+    c = self.coefs
+    return ((c[fi,0,vi]*dv + c[fi,1,vi])*dv + c[fi,2,vi])*dv + c[fi,3,vi]
+
+  def model(self, freq):
+    """
+    Attenuator model for one frequency
+
+    For the cubic surface this is exact since blending the coefficients of two
+    frequencies gives the same piecewise cubic as blending their values.  For
+    the linear surface the curve is piecewise linear through the blended row.
+    """
+    freq = float(freq)
+    if freq in self._models:
+      self._models.move_to_end(freq)
+    else:
+      fi, ft, step = self._freq_index(freq)
+      fi = int(fi)
+      ft = float(ft)
+      if self.kind == "linear":
+        row = (1-ft)*self.gains[fi] + ft*self.gains[fi+step]
+        coefs = NP.zeros((4, len(self.volts)-1))
+        coefs[2] = NP.diff(row)/NP.diff(self.volts)
+        coefs[3] = row[:-1]
+        curve = PiecewiseCubic(self.volts, coefs)
+      else:
+        curve = PiecewiseCubic(self.volts,
+                               (1-ft)*self.coefs[fi] + ft*self.coefs[fi+step])
+      self._models[freq] = AttenuatorModel(curve)
+      while len(self._models) > self.max_models:
+        self._models.popitem(last=False)
+    return self._models[freq]
+
+  def inverse(self, freq, gain):
+    """
+    Control voltage which gives the requested gain at one frequency
+    """
+    return self.model(freq).inverse(gain)
+
+
+# ---------------------------- module methods ---------------------------------
+
+def load_surfaces(filename, kind="cubic"):
+  """
+  Calibration surfaces for each receiver and polarization in a CSV data file
+
+  The gains are the measured powers minus the reference powers.  Surfaces
+  are keyed like channel IDs without the frequency, e.g. 'R1-E'.
+
+  @param filename : name of the data file (see dataset.py)
+  @type  filename : str
+
+  @param kind : "cubic" or "linear"
+  @type  kind : str
+
+  @return: dict of CalibrationSurface instances
+  """
+  dataset = load_dataset(filename)
+  gains = dataset.gains
+  columns = {}
+  for column, chanID in enumerate(dataset.chanIDs):
+    key = dataset.receivers[column]+'-'+dataset.pols[column]
+    columns.setdefault(key, []).append(column)
+  surfaces = {}
+  for key in columns:
+    surfaces[key] = CalibrationSurface(dataset.freqs[columns[key]],
+                                       dataset.volts,
+                                       gains[:,columns[key]].T, kind=kind)
+  return surfaces
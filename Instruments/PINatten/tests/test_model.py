@@ -0,0 +1,24 @@
+"""
+Tests of fitting monotone attenuator models
+"""
+import numpy as NP
+
+from Electronics.Instruments.PINatten.model import AttenuatorModel, fit_models
+
+volts = NP.linspace(-10, 0.8, 22)
+gains = -27 + 19/(1 + NP.exp(-(volts + 3)))
+
+def test_descending_volts():
+  models = fit_models({'up': volts, 'down': volts[::-1]},
+                      {'up': gains, 'down': gains[::-1]}, ['up', 'down'])
+  assert models['down'].volts_range == (-10., 0.8)
+  assert NP.allclose(models['down'](volts), models['up'](volts))
+
+def test_unequal_lengths():
+  models = fit_models({'all': volts[::-1], 'half': volts[::2]},
+                      {'all': gains[::-1], 'half': gains[::2]},
+                      ['all', 'half'])
+  expected = AttenuatorModel.fit(volts[::2], gains[::2])
+  test_volts = volts[:-1]
+  assert NP.allclose(models['half'](test_volts), expected(test_volts))
+  assert NP.allclose(models['all'](volts), gains)
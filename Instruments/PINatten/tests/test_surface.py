@@ -0,0 +1,18 @@
+"""
+Tests of frequency-dependent calibration surfaces
+"""
+import numpy as NP
+
+from Electronics.Instruments.PINatten.surface import CalibrationSurface
+
+freqs = [18., 22., 26.]
+volts = NP.linspace(-10, 0.8, 12)
+gains = [-27 + 19/(1 + NP.exp(-(volts + 3 + shift))) for shift in (0, 0.5, 1)]
+
+def test_model_matches_surface():
+  test_volts = NP.linspace(-10, 0.8, 97)
+  for kind in ("linear", "cubic"):
+    surface = CalibrationSurface(freqs, volts, gains, kind=kind)
+    for freq in (18., 21., 24.5, 26.):
+      assert NP.allclose(surface.model(freq)(test_volts),
+                         surface(freq, test_volts))
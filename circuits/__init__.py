@@ -2,40 +2,67 @@
 support for circuit modeling
 """
 import logging
-from math import floor, log10
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# standard component values in one decade
+E_series = {
+  "E12": np.array([1.0, 1.2, 1.5, 1.8, 2.2, 2.7, 3.3, 3.9, 4.7, 5.6, 6.8, 8.2]),
+  "E24": np.array([1.0, 1.1, 1.2, 1.3, 1.5, 1.6, 1.8, 2.0, 2.2, 2.4, 2.7, 3.0,
+                   3.3, 3.6, 3.9, 4.3, 4.7, 5.1, 5.6, 6.2, 6.8, 7.5, 8.2, 9.1]),
+  # E96 values are 10^(i/96) to three figures
+  "E96": np.round(10**(np.arange(96)/96.), 2)}
+
+# logarithms of each series with the first value of the next decade appended,
+# for binary search
+_log_series = dict((name, np.log10(np.append(values, 10.)))
+                   for name, values in E_series.items())
+
+def snap_to_series(values, series="E24"):
+  """
+  nearest standard component values
+
+  Values are compared on a logarithmic scale, i.e. by their ratio.
+
+  Args
+  ====
+  values - (float or nparray) positive component values
+  series - (str) "E12", "E24" or "E96"
+  """
+  values = np.asarray(values, dtype=float)
+  logs = np.log10(values)
+  decade = np.floor(logs)
+  table = _log_series[series]
+  mantissa = logs - decade
+  upper = np.clip(np.searchsorted(table, mantissa), 1, len(table)-1)
+  lower = upper - 1
+  nearest = np.where(mantissa - table[lower] <= table[upper] - mantissa,
+                     lower, upper)
+  return 10**(decade + table[nearest])
+
+multipliers = {-15: "f", -12: "p", -9: "n", -6: "u", -3: "m", 0: ""}
+
 def component_text(component):
   """
   returns a text string for the component
-  
+
+  Values of 1 or more are given without a multiplier and those below 1e-15
+  in f.  Arrays of values (and units) give an array of strings.
+
   Args
   ====
-  component - (float, str) reactance value and unit ('F' or 'H')
+  component - (float, str) reactance value and unit ('F' or 'H'); either
+              may be an array
   """
-  multipliers = {-15: "f", -12: "p", -9: "n", -6: "u", -3: "m", 0: ""}
-  value = component[0]
-  unit = component[1]
-  expon = floor(log10(value))
-  if expon < -15:
-    display = value/10**(expon-mul)
-    return str(display)+"f"+unit
-  for mul in multipliers.keys():
-    #print("testing expon=",expon,"against multiplier",mul)
-    if mul == expon:
-      #print("exact match")
-      # exact match
-      display = value/10**mul
-      return str(round(display,2))+multipliers[mul]+unit
-    elif expon < mul:
-      #print(expon,"<",mul)
-      # passed highest multiplier less than exponent
-      display = value/10**(mul-3)
-      return str(round(display,2))+multipliers[mul-3]+unit
-    elif expon > mul:
-      continue
-    else:
-      # must have passed  zero
-      return str(value)+unit
-
+  value = np.asarray(component[0], dtype=float)
+  unit = np.asarray(component[1])
+  expon = np.floor(np.log10(np.where(value > 0, value, 1.)))
+  mul = np.clip(3*(expon//3), -15, 0).astype(int)
+  display = np.round(value/10.**mul, 2)
+  value, unit, mul, display = np.broadcast_arrays(value, unit, mul, display)
+  text = np.array([str(float(shown))+multipliers[m]+u
+                   for shown, m, u in zip(display.ravel(), mul.ravel(),
+                                          unit.ravel())])
+  text = text.reshape(value.shape)
+  return str(text[()]) if text.ndim == 0 else text
@@ -0,0 +1,180 @@
+"""
+caches responses of circuit functions
+
+Interactive design and plotting evaluate the same responses over and over.
+A ResponseCache keeps recent results, keyed by the function, its argument
+values and a fingerprint (a hash of the contents) of each array argument such
+as the frequency grid, up to a limit on the memory they use::
+
+  V = response_cache.call(V_lopass, 1, 50, C, L, 50, f)
+
+or with the wrapped functions in this module::
+
+  from Electronics.circuits.cache import V_lopass
+  V = V_lopass(1, 50, C, L, 50, f)
+
+Cached arrays are read-only since they are shared.  Calls with `out` or
+`work` buffers are not cached, nor are calls with an argument which cannot be
+identified by its value, such as a bound method or a callable object.
+"""
+import hashlib
+import logging
+import threading
+import types
+from collections import OrderedDict
+from functools import partial, wraps
+import numpy as np
+
+from Electronics.circuits import filters, smith
+
+logger = logging.getLogger(__name__)
+
+def fingerprint(value):
+  """
+  hashable key for an argument value
+
+  Arrays are identified by dtype, shape and a hash of their contents, so an
+  array changed in place gets a new key.  Functions are identified by where
+  they are defined and the values they close over, and partials by their
+  function and arguments.  Other callables, e.g. bound methods, depend on
+  the state of an object and raise TypeError.
+  """
+  if isinstance(value, np.ndarray):
+    digest = hashlib.blake2b(np.ascontiguousarray(value).view(np.uint8),
+                             digest_size=16).hexdigest()
+    return ("array", value.dtype.str, value.shape, digest)
+  if isinstance(value, (list, tuple)):
+    return (type(value).__name__,) + tuple(fingerprint(item) for item in value)
+  if isinstance(value, dict):
+    return ("dict",) + tuple((key, fingerprint(value[key]))
+                             for key in sorted(value))
+  if isinstance(value, partial):
+    return ("partial", fingerprint(value.func), fingerprint(value.args),
+            fingerprint(value.keywords))
+  if isinstance(value, types.FunctionType):
+    code = value.__code__
+    cells = []
+    for cell in value.__closure__ or ():
+      try:
+        cells.append(fingerprint(cell.cell_contents))
+      except ValueError:
+        # empty cell
+        cells.append(None)
+    consts = tuple(const for const in code.co_consts
+                   if not isinstance(const, types.CodeType))
+    return ("function", value.__module__, value.__qualname__,
+            code.co_filename, code.co_firstlineno, code.co_code, consts,
+            code.co_names, tuple(cells), fingerprint(value.__defaults__))
+  if isinstance(value, types.BuiltinFunctionType) and \
+                                  isinstance(value.__self__, types.ModuleType):
+    return ("builtin", value.__module__, value.__qualname__)
+  if isinstance(value, np.ufunc):
+    return ("ufunc", value.__name__)
+  if callable(value):
+    raise TypeError("%r cannot be identified by value" % value)
+  return value
+
+class ResponseCache(object):
+  """
+  least recently used cache of function results, limited in size and memory
+
+  Attributes
+  ==========
+  hits      - (int) calls answered from the cache
+  misses    - (int) calls which had to be computed
+  evictions - (int) results dropped to make room
+  nbytes    - (int) memory used by cached arrays
+  """
+  def __init__(self, maxbytes=256*2**20, maxsize=1024):
+    """
+    Args
+    ====
+    maxbytes - (int) memory allowed for cached results
+    maxsize  - (int) largest number of cached results
+    """
+    self.maxbytes = maxbytes
+    self.maxsize = maxsize
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.nbytes = 0
+
+  def call(self, func, *args, **kwargs):
+    """
+    result of func(*args, **kwargs), from the cache if possible
+    """
+    if kwargs.get("out") is not None or kwargs.get("work") is not None:
+      return func(*args, **kwargs)
+    try:
+      key = (fingerprint(func), fingerprint(args), fingerprint(kwargs))
+      hash(key)
+    except TypeError as details:
+      logger.debug("call: not cached: %s", details)
+      return func(*args, **kwargs)
+    with self._lock:
+      if key in self._entries:
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._entries[key][0]
+      self.misses += 1
+    result = func(*args, **kwargs)
+    size = result.nbytes if isinstance(result, np.ndarray) else 64
+    if size > self.maxbytes:
+      return result
+    if isinstance(result, np.ndarray):
+      result.flags.writeable = False
+    with self._lock:
+      if key not in self._entries:
+        self._entries[key] = (result, size, func)
+        self.nbytes += size
+      while self.nbytes > self.maxbytes or len(self._entries) > self.maxsize:
+        old, (value, old_size, old_func) = self._entries.popitem(last=False)
+        self.nbytes -= old_size
+        self.evictions += 1
+    return result
+
+  def wrap(self, func):
+    """
+    function like `func` which uses this cache
+    """
+    @wraps(func)
+    def cached(*args, **kwargs):
+      return self.call(func, *args, **kwargs)
+    cached.cache = self
+    return cached
+
+  def invalidate(self, func=None):
+    """
+    drop all cached results, or only those of one function
+    """
+    if hasattr(func, "__wrapped__"):
+      func = func.__wrapped__
+    with self._lock:
+      for key in list(self._entries):
+        if func is None or self._entries[key][2] is func:
+          self.nbytes -= self._entries.pop(key)[1]
+
+  def info(self):
+    """
+    cache statistics
+    """
+    with self._lock:
+      return {"hits": self.hits, "misses": self.misses,
+              "evictions": self.evictions, "entries": len(self._entries),
+              "nbytes": self.nbytes, "maxbytes": self.maxbytes}
+
+  def __len__(self):
+    return len(self._entries)
+
+
+response_cache = ResponseCache()
+
+V_lopass = response_cache.wrap(filters.V_lopass)
+V_hipass = response_cache.wrap(filters.V_hipass)
+V_bandpass = response_cache.wrap(filters.V_bandpass)
+Z_lopass = response_cache.wrap(filters.Z_lopass)
+Z_hipass = response_cache.wrap(filters.Z_hipass)
+Z_bandpass = response_cache.wrap(filters.Z_bandpass)
+matched_impedance = response_cache.wrap(smith.matched_impedance)
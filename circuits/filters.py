@@ -2,11 +2,34 @@
 computes responses of filters in book Filters section
 """
 import logging
-from numpy import abs, angle, arctan2, imag, pi, real, sqrt
+from numpy import (abs, angle, arctan2, asarray, broadcast, divide, empty,
+                   errstate, imag, multiply, pi, real, reciprocal, sqrt, where)
+
+from Electronics.circuits import snap_to_series
 
 logger = logging.getLogger(__name__)
 
-def Xcap(C, f):
+# All the functions below take optional `out` and `work` arrays.  The result
+# is computed in place in `out` with `work` for an intermediate value, so a
+# caller which passes both (e.g. an optimizer evaluating many times on one
+# frequency grid) allocates nothing.  They must be complex arrays with the
+# broadcast shape of the arguments.  Each reactance is computed once.
+
+def _buffer(out, *args):
+  """
+  complex array with the broadcast shape of the arguments
+  """
+  if out is None:
+    out = empty(broadcast(*args).shape, dtype=complex)
+  return out
+
+def _result(out):
+  """
+  a scalar for scalar arguments, as before
+  """
+  return out[()] if out.ndim == 0 else out
+
+def Xcap(C, f, out=None):
   """
   reactance of capacitor
   
@@ -21,10 +44,13 @@ def Xcap(C, f):
   =======
   (complex)
   """
-  nu = 2*pi*f
-  return 0-1j/(nu*C)
+  out = _buffer(out, C, f)
+  multiply(f, C, out=out)
+  out *= 2*pi
+  divide(-1j, out, out=out)
+  return _result(out)
 
-def Xind(L, f):
+def Xind(L, f, out=None):
   """
   reactance of inductor
   
@@ -37,101 +63,162 @@ def Xind(L, f):
   =======
   (complex)
   """
-  nu = 2*pi*f
-  return 0+1j*nu*L
+  out = _buffer(out, L, f)
+  multiply(f, L, out=out)
+  out *= 2j*pi
+  return _result(out)
 
-def Z_low(L, R_L, f):
+def Z_low(L, R_L, f, out=None):
   """
   impedance in load branch
   
   inductor and load in series
   """
-  return Xind(L,f) + R_L 
+  out = _buffer(out, L, R_L, f)
+  Xind(L, f, out=out)
+  out += R_L
+  return _result(out)
 
-def Z_high(C, R_L, f):
+def Z_high(C, R_L, f, out=None):
   """
   impedance in load branch
   
   capacitor and load in series; low frequencies blocked
   """
-  return Xcap(C,f) + R_L 
+  out = _buffer(out, C, R_L, f)
+  Xcap(C, f, out=out)
+  out += R_L
+  return _result(out)
 
-def Z_lopass(C, L, R_L, f):
+def Z_lopass(C, L, R_L, f, out=None, work=None):
   """
   extra lowpass with a shunt capacitance for high frequencies
   
   capacitor in parallel with (inductor+load)
   """
-  return 1/(1/Xcap(C,f) + 1/Z_low(L, R_L, f))
+  out = _buffer(out, C, L, R_L, f)
+  work = _buffer(work, L, R_L, f)
+  # admittance of the load branch plus that of the capacitor, 2 pi f C
+  reciprocal(Z_low(L, R_L, f, out=work), out=work)
+  multiply(f, C, out=out)
+  out *= 2j*pi
+  out += work
+  reciprocal(out, out=out)
+  return _result(out)
   
-def Z_hipass(C, L, R_L, f):
+def Z_hipass(C, L, R_L, f, out=None, work=None):
   """
   extra high pass with shunt inductor for low frequencies
   
   inductor and capacitor+load in parallel; low frequencies shorted
   """
-  return 1/(1/Xind(L,f) + 1/Z_high(C, R_L, f))
+  out = _buffer(out, C, L, R_L, f)
+  work = _buffer(work, C, R_L, f)
+  reciprocal(Z_high(C, R_L, f, out=work), out=work)
+  reciprocal(Xind(L, f, out=out), out=out)
+  out += work
+  reciprocal(out, out=out)
+  return _result(out)
   
-def Z_bandpass(C, L, R_L, f):
+def Z_bandpass(C, L, R_L, f, out=None, work=None):
   """
   impedance of circuit
   
   capacitor and inductor+load in parallel
   """
-  return 1/(1/Xind(L, f) + 1/Xcap(C, f) + 1/R_L)
+  out = _buffer(out, C, L, R_L, f)
+  work = _buffer(work, L, f)
+  reciprocal(Xind(L, f, out=work), out=work)
+  multiply(f, C, out=out)
+  out *= 2j*pi
+  out += work
+  out += 1/R_L
+  reciprocal(out, out=out)
+  return _result(out)
 
-def V_lopass(V, R_S, C, L, R_L, f):
+def V_lopass(V, R_S, C, L, R_L, f, out=None, work=None):
   """
   lowpass filter's output voltage
   
   current through the load times the load impedance
-  """
-  # current in circuit
-  I = V/(R_S + Z_lopass(C, L, R_L, f))
-  # voltage across circuit
-  V_out = V - I*R_S
-  I_C = V_out/Xcap(C, f)
-  I_L = V_out/Z_low(L, R_L, f)
-  V_L = I_L*R_L
-  return V_L
+  
+  With Y_C = 2 pi f C the load branch current is V_out/Z_low where
+  V_out = V Z/(R_S + Z), which reduces to::
+  
+    V_L = V R_L/(R_S + Z_low (1 + R_S Y_C))
+  """
+  out = _buffer(out, V, R_S, C, L, R_L, f)
+  work = _buffer(work, L, R_L, f)
+  Z_low(L, R_L, f, out=work)
+  multiply(f, C, out=out)
+  out *= 2j*pi*R_S
+  out += 1
+  out *= work
+  out += R_S
+  divide(V*R_L, out, out=out)
+  return _result(out)
 
-def V_hipass(V, R_S, C, L, R_L, f):
+def V_hipass(V, R_S, C, L, R_L, f, out=None, work=None):
   """
   filter output voltage
   
   current through the load times the load impedance
-  """
-  # current in circuit
-  I = V/(R_S + Z_hipass(C, L, R_L, f))
-  # voltage across circuit
-  V_out = V - I*R_S
-  I_L = V_out/Z_high(C, R_L, f) # current through load branch
-  V_L = I_L*R_L # voltage across load
-  return V_L
+  
+  With Y_L = 1/(2 pi f L) this reduces to::
+  
+    V_L = V R_L/(R_S + Z_high (1 + R_S Y_L))
+  """
+  out = _buffer(out, V, R_S, C, L, R_L, f)
+  work = _buffer(work, C, R_L, f)
+  Z_high(C, R_L, f, out=work)
+  reciprocal(Xind(L, f, out=out), out=out)
+  out *= R_S
+  out += 1
+  out *= work
+  out += R_S
+  divide(V*R_L, out, out=out)
+  return _result(out)
 
-def V_bandpass(V, R_S, C, L, R_L, f):
+def V_bandpass(V, R_S, C, L, R_L, f, out=None, work=None):
   """
   filter output voltage
   
-  input voltage minus the current times the source impedance
-  """
-  # current in circuit
-  I = V/(R_S + Z_bandpass(C, L, R_L, f))
-  # voltage across circuit
-  V_out = V - I*R_S
-  return V_out
+  input voltage minus the current times the source impedance, which is::
+  
+    V_out = V/(1 + R_S/Z_bandpass)
+  """
+  out = _buffer(out, V, R_S, C, L, R_L, f)
+  Z_bandpass(C, L, R_L, f, out=out, work=work)
+  reciprocal(out, out=out)
+  out *= R_S
+  out += 1
+  divide(V, out, out=out)
+  return _result(out)
 
-def reactance_to_component(reactance, freq):
+def reactance_to_component(reactance, freq, series=None):
   """
     Based on X = 1/(2 pi f C), and X = 2 pi f L,
     so       C = 1/(2 pi f X), and L = X/(2 pi f)
-  """
-  logger.debug("reactance_to_component: reactance= %8.3f", reactance)
-  factor = 2*pi*freq
-  if reactance < 0:
-    # compute capacitance
-    return -1/(factor*reactance), "F"
-  else:
-    # compute inductance
-    return reactance/factor, "H"
 
+  Args
+  ====
+  reactance - (float or nparray) reactance in ohms; negative is capacitive
+  freq      - (float or nparray) frequency in Hz
+  series    - (str) snap values to "E12", "E24" or "E96" standard values
+
+  Returns
+  =======
+  (value, unit) - floats and 'F' or 'H' for scalars; arrays for arrays
+  """
+  logger.debug("reactance_to_component: reactance= %s", reactance)
+  reactance = asarray(reactance, dtype=float)
+  factor = 2*pi*asarray(freq, dtype=float)
+  capacitive = reactance < 0
+  with errstate(divide="ignore"):
+    value = where(capacitive, -1/(factor*reactance), reactance/factor)
+  if series:
+    value = snap_to_series(value, series)
+  unit = where(capacitive, "F", "H")
+  if value.ndim == 0:
+    return float(value), str(unit)
+  return value, unit
@@ -0,0 +1,133 @@
+"""
+computes filter metrics from complex responses
+
+The responses of `filters`, `network` or `sweep` are complex arrays with
+frequency along the last axis; any leading axes are a batch of responses,
+e.g. from a sweep over component values::
+
+  V = sweep(V_bandpass, f, V=1, R_S=50, C=Cs, L=1e-6, R_L=50)
+  m = filter_metrics(V, f)
+  m["Q"]            # array with shape (len(Cs),)
+
+The cutoff frequencies are where the magnitude has dropped by `drop` dB
+(3 by default) from its peak, found by bracketing the crossing between two
+frequency points and interpolating linearly in dB against log frequency.
+A low pass response has no lower cutoff (NaN) and its bandwidth is the upper
+cutoff; a high pass response has no upper cutoff and no bandwidth.
+"""
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def magnitude_db(H):
+  """
+  magnitude in dB
+  """
+  with np.errstate(divide="ignore"):
+    return 20*np.log10(np.abs(H))
+
+def unwrapped_phase(H):
+  """
+  phase in radians without jumps of 2 pi along frequency
+  """
+  return np.unwrap(np.angle(H), axis=-1)
+
+def group_delay(H, f):
+  """
+  group delay -d(phase)/d(omega) in seconds
+
+  Args
+  ====
+  H - (complex nparray) responses, frequency along the last axis
+  f - (nparray) frequencies in Hz, ascending; need not be evenly spaced
+  """
+  return -np.gradient(unwrapped_phase(H), 2*np.pi*np.asarray(f), axis=-1)
+
+def _interpolate(x, y, index, level):
+  """
+  x where y crosses level between index and index+1
+  """
+  x0 = np.take_along_axis(x, index, axis=-1)
+  x1 = np.take_along_axis(x, index+1, axis=-1)
+  y0 = np.take_along_axis(y, index, axis=-1)
+  y1 = np.take_along_axis(y, index+1, axis=-1)
+  with np.errstate(divide="ignore", invalid="ignore"):
+    t = np.where(y1 != y0, (level - y0)/(y1 - y0), 0.)
+  return x0 + t*(x1 - x0)
+
+def cutoffs(H, f, drop=3.):
+  """
+  frequencies on each side of the peak where the response is `drop` dB down
+
+  Args
+  ====
+  H    - (complex nparray) responses, frequency along the last axis
+  f    - (nparray) frequencies in Hz, ascending
+  drop - (float) dB below the peak
+
+  Returns
+  =======
+  (lower, upper) nparrays with the batch shape; NaN where there is no crossing
+  """
+  f = np.asarray(f, dtype=float)
+  mag = magnitude_db(H)
+  batch = mag.shape[:-1]
+  mag = mag.reshape(-1, len(f))
+  x = np.broadcast_to(np.log10(f) if f[0] > 0 else f, mag.shape)
+  peak = np.argmax(mag, axis=-1)[:,np.newaxis]
+  level = np.take_along_axis(mag, peak, axis=-1) - drop
+  below = mag < level
+  position = np.arange(len(f))
+  # first point below the level after the peak
+  after = below & (position > peak)
+  upper_index = np.argmax(after, axis=-1)[:,np.newaxis]
+  upper = _interpolate(x, mag, upper_index-1, level)[:,0]
+  upper[~after.any(axis=-1)] = np.nan
+  # last point below the level before the peak
+  before = below & (position < peak)
+  lower_index = len(f) - 1 - np.argmax(before[:,::-1], axis=-1)[:,np.newaxis]
+  lower_index = np.minimum(lower_index, len(f)-2)
+  lower = _interpolate(x, mag, lower_index, level)[:,0]
+  lower[~before.any(axis=-1)] = np.nan
+  if f[0] > 0:
+    lower, upper = 10**lower, 10**upper
+  return lower.reshape(batch), upper.reshape(batch)
+
+def filter_metrics(H, f, drop=3.):
+  """
+  summary of a batch of filter responses
+
+  Args
+  ====
+  H    - (complex nparray) responses, frequency along the last axis
+  f    - (nparray) frequencies in Hz, ascending
+  drop - (float) dB below the peak defining the cutoffs and bandwidth
+
+  Returns
+  =======
+  dict of nparrays with the batch shape::
+
+    peak_db, peak_freq - largest magnitude and its frequency
+    lower, upper       - cutoff frequencies
+    bandwidth          - upper - lower, or upper for a low pass
+    center             - geometric mean of the cutoffs
+    Q                  - center/bandwidth
+    delay              - group delay at the peak (s)
+  """
+  f = np.asarray(f, dtype=float)
+  mag = magnitude_db(H)
+  peak = np.argmax(mag, axis=-1)
+  lower, upper = cutoffs(H, f, drop)
+  bandwidth = np.where(np.isnan(lower), upper, upper - lower)
+  center = np.sqrt(lower*upper)
+  delay = np.take_along_axis(group_delay(H, f), peak[...,np.newaxis],
+                             axis=-1)[...,0]
+  return {"peak_db": np.max(mag, axis=-1),
+          "peak_freq": f[peak],
+          "lower": lower,
+          "upper": upper,
+          "bandwidth": bandwidth,
+          "center": center,
+          "Q": center/bandwidth,
+          "delay": delay}
@@ -0,0 +1,198 @@
+"""
+cascades two-port networks using ABCD (chain) matrices
+
+A ladder network is a list of elements, from the source end to the load end.
+Each element is a tuple::
+
+  ("series", part, value) - impedance in series with the signal path
+  ("shunt",  part, value) - impedance across the signal path
+  ("twoport", abcd)       - any two-port, as an ABCD array with shape
+                            (..., 2, 2) or a function of frequency returning one
+
+where `part` is "R" (ohms), "L" (H), "C" (F) or "Z" (a complex impedance, or a
+function of frequency returning one).  `series_LC` and `parallel_LC` make
+resonators for "Z" parts.  For example, the low pass filter of
+`filters.V_lopass` is::
+
+  [("shunt", "C", C), ("series", "L", L)]
+
+Values may be arrays; they are broadcast against the frequency array, so one
+pass computes a whole frequency grid (and a grid of component values).  The
+result of `cascade` has the broadcast shape followed by (2,2).
+
+Notes
+=====
+
+  V1 = A V2 + B I2
+  I1 = C V2 + D I2
+
+with port 1 at the source and port 2 at the load, current I2 flowing out into
+the load.
+"""
+import logging
+import numpy as np
+
+from Electronics.circuits.filters import Xcap, Xind
+
+logger = logging.getLogger(__name__)
+
+def series_LC(L, C):
+  """
+  impedance function of an inductor and capacitor in series
+  """
+  return lambda f: Xind(L, f) + Xcap(C, f)
+
+def parallel_LC(L, C):
+  """
+  impedance function of an inductor and capacitor in parallel (tank circuit)
+  """
+  return lambda f: 1/(1/Xind(L, f) + 1/Xcap(C, f))
+
+def element_impedance(part, value, f):
+  """
+  impedance of a ladder element at frequencies `f`
+
+  Args
+  ====
+  part  - (str) "R", "L", "C" or "Z"
+  value - (float, array or function) component value
+  f     - (float or nparray) frequency in Hz
+  """
+  if part == "R":
+    return np.asarray(value, dtype=complex)
+  elif part == "L":
+    return Xind(value, f)
+  elif part == "C":
+    return Xcap(value, f)
+  elif part == "Z":
+    if callable(value):
+      return value(f)
+    return np.asarray(value, dtype=complex)
+  raise ValueError("unknown part %s" % part)
+
+def cascade(elements, f):
+  """
+  ABCD matrix of a ladder network
+
+  Series and shunt elements are applied to the four matrix entries directly
+  instead of by matrix multiplication::
+
+    series Z: B += A Z,  D += C Z
+    shunt  Y: A += B Y,  C += D Y
+
+  Args
+  ====
+  elements - (list of tuples) see module description
+  f        - (float or nparray) frequencies in Hz
+
+  Returns
+  =======
+  complex nparray with shape (..., 2, 2)
+  """
+  f = np.asarray(f, dtype=float)
+  A = np.ones(f.shape, dtype=complex)
+  B = np.zeros(f.shape, dtype=complex)
+  C = np.zeros(f.shape, dtype=complex)
+  D = np.ones(f.shape, dtype=complex)
+  for element in elements:
+    position = element[0]
+    if position == "series":
+      Z = element_impedance(element[1], element[2], f)
+      B = B + A*Z
+      D = D + C*Z
+    elif position == "shunt":
+      Y = 1/element_impedance(element[1], element[2], f)
+      A = A + B*Y
+      C = C + D*Y
+    elif position == "twoport":
+      T = element[1](f) if callable(element[1]) else np.asarray(element[1])
+      A, B, C, D = (A*T[...,0,0] + B*T[...,1,0], A*T[...,0,1] + B*T[...,1,1],
+                    C*T[...,0,0] + D*T[...,1,0], C*T[...,0,1] + D*T[...,1,1])
+    else:
+      raise ValueError("unknown element position %s" % position)
+  A, B, C, D = np.broadcast_arrays(A, B, C, D)
+  return np.stack([np.stack([A, B], axis=-1), np.stack([C, D], axis=-1)],
+                  axis=-2)
+
+def input_impedance(abcd, Z_L):
+  """
+  impedance looking into port 1 with a load on port 2
+
+  Args
+  ====
+  abcd - (complex nparray) ABCD matrices, shape (..., 2, 2)
+  Z_L  - (complex or nparray) load impedance
+  """
+  return (abcd[...,0,0]*Z_L + abcd[...,0,1])/(abcd[...,1,0]*Z_L + abcd[...,1,1])
+
+def transfer_voltage(abcd, Z_S, Z_L, V=1.):
+  """
+  voltage across the load driven by a source with internal impedance
+
+  With `V=1` this is the voltage transfer function.  For the networks in
+  `filters` it is the same as `V_lopass`, `V_hipass` and `V_bandpass`.
+
+  Args
+  ====
+  abcd - (complex nparray) ABCD matrices, shape (..., 2, 2)
+  Z_S  - (complex or nparray) source impedance
+  Z_L  - (complex or nparray) load impedance
+  V    - (complex or nparray) open circuit source voltage
+  """
+  A, B = abcd[...,0,0], abcd[...,0,1]
+  C, D = abcd[...,1,0], abcd[...,1,1]
+  return V*Z_L/(A*Z_L + B + Z_S*(C*Z_L + D))
+
+def abcd_to_s(abcd, Z0=50.):
+  """
+  scattering parameters from ABCD matrices
+
+  Args
+  ====
+  abcd - (complex nparray) ABCD matrices, shape (..., 2, 2)
+  Z0   - (float) reference impedance of both ports
+
+  Returns
+  =======
+  complex nparray with shape (..., 2, 2) with S11, S12 in the first row
+  """
+  A, B = abcd[...,0,0], abcd[...,0,1]/Z0
+  C, D = abcd[...,1,0]*Z0, abcd[...,1,1]
+  denom = A + B + C + D
+  S = np.empty(abcd.shape, dtype=complex)
+  S[...,0,0] = (A + B - C - D)/denom
+  S[...,0,1] = 2*(A*D - B*C)/denom
+  S[...,1,0] = 2/denom
+  S[...,1,1] = (-A + B - C + D)/denom
+  return S
+
+def s_to_abcd(S, Z0=50.):
+  """
+  ABCD matrices from scattering parameters
+
+  Args
+  ====
+  S  - (complex nparray) S-parameters, shape (..., 2, 2)
+  Z0 - (float) reference impedance of both ports
+  """
+  S11, S12 = S[...,0,0], S[...,0,1]
+  S21, S22 = S[...,1,0], S[...,1,1]
+  denom = 2*S21
+  abcd = np.empty(S.shape, dtype=complex)
+  abcd[...,0,0] = ((1 + S11)*(1 - S22) + S12*S21)/denom
+  abcd[...,0,1] = Z0*((1 + S11)*(1 + S22) - S12*S21)/denom
+  abcd[...,1,0] = ((1 - S11)*(1 - S22) - S12*S21)/denom/Z0
+  abcd[...,1,1] = ((1 - S11)*(1 + S22) + S12*S21)/denom
+  return abcd
+
+def s_parameters(elements, f, Z0=50.):
+  """
+  scattering parameters of a ladder network
+
+  Args
+  ====
+  elements - (list of tuples) see module description
+  f        - (float or nparray) frequencies in Hz
+  Z0       - (float) reference impedance of both ports
+  """
+  return abcd_to_s(cascade(elements, f), Z0=Z0)
@@ -0,0 +1,236 @@
+"""
+searches for component values which meet a filter response mask
+
+A design is a ladder topology (see `network`) with unknown values, e.g. the
+networks of `filters`::
+
+  topologies["lopass"] = [("shunt", "C"), ("series", "L")]
+
+and a FilterMask gives the requirements::
+
+  mask = FilterMask(passband=(1e6, 10e6), ripple=1,
+                    stopbands=[(30e6, 100e6, 40)],
+                    match=(1e6, 10e6), return_loss=10)
+
+`optimize` searches the values in log space by differential evolution.  Each
+generation is evaluated in one broadcast `network.cascade` over (candidates x
+frequencies), or in a pool of processes for large populations, and the best
+designs are returned ranked by how far they miss the mask.
+"""
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from Electronics.circuits.network import (cascade, input_impedance,
+                                          transfer_voltage)
+
+logger = logging.getLogger(__name__)
+
+topologies = {"lopass":   [("shunt", "C"), ("series", "L")],
+              "hipass":   [("shunt", "L"), ("series", "C")],
+              "bandpass": [("shunt", "L"), ("shunt", "C")]}
+
+class FilterMask(object):
+  """
+  limits on insertion loss and input match
+
+  Attributes
+  ==========
+  freqs - (nparray) frequencies at which the mask is checked
+  bands - (list) (kind, slice of freqs, limit in dB) for each band
+  """
+  def __init__(self, passband=None, ripple=1., stopbands=(), match=None,
+               return_loss=10., num=101):
+    """
+    Args
+    ====
+    passband    - (f1, f2) in Hz
+    ripple      - (float) largest insertion loss (dB) in the passband
+    stopbands   - list of (f1, f2, attenuation) with the smallest insertion
+                  loss (dB) in each band
+    match       - (f1, f2) band in which the input must be matched
+    return_loss - (float) smallest return loss (dB) in the match band
+    num         - (int) number of frequencies in each band
+    """
+    bands = []
+    if passband:
+      bands.append(("pass", passband, ripple))
+    for f1, f2, atten in stopbands:
+      bands.append(("stop", (f1, f2), atten))
+    if match:
+      bands.append(("match", match, return_loss))
+    freqs = []
+    self.bands = []
+    for kind, (f1, f2), limit in bands:
+      start = len(freqs)*num
+      freqs.append(np.geomspace(f1, f2, num))
+      self.bands.append((kind, slice(start, start+num), limit))
+    self.freqs = np.concatenate(freqs)
+
+  def excess(self, loss, return_loss):
+    """
+    amounts (dB) by which the responses violate each band
+
+    Args
+    ====
+    loss        - (nparray) insertion loss (dB), shape (designs, len(freqs))
+    return_loss - (nparray) return loss (dB), same shape
+
+    Returns
+    =======
+    nparray with shape (designs, len(bands)), worst violation in each band
+    """
+    result = np.empty((len(loss), len(self.bands)))
+    for index, (kind, band, limit) in enumerate(self.bands):
+      if kind == "pass":
+        miss = loss[:,band] - limit
+      elif kind == "stop":
+        miss = limit - loss[:,band]
+      else:
+        miss = limit - return_loss[:,band]
+      result[:,index] = np.maximum(miss.max(axis=1), 0)
+    return result
+
+
+def ladder(topology, values):
+  """
+  ladder network elements from a topology and values
+
+  Args
+  ====
+  topology - list of (position, part); see `network`
+  values   - sequence of values, one for each element
+  """
+  return [(position, part, value)
+          for (position, part), value in zip(topology, values)]
+
+def response(topology, values, f, R_S=50., R_L=50.):
+  """
+  insertion loss and return loss (dB) of designs
+
+  Args
+  ====
+  topology - list of (position, part)
+  values   - (nparray) component values, shape (designs, len(topology))
+  f        - (nparray) frequencies in Hz
+
+  Returns
+  =======
+  (nparray, nparray) each with shape (designs, len(f))
+  """
+  values = np.asarray(values, dtype=float)
+  columns = [values[:,index,np.newaxis] for index in range(values.shape[1])]
+  abcd = cascade(ladder(topology, columns), f[np.newaxis,:])
+  S21 = 2*transfer_voltage(abcd, R_S, R_L)*np.sqrt(R_S/R_L)
+  Zin = input_impedance(abcd, R_L)
+  S11 = (Zin - R_S)/(Zin + R_S)
+  with np.errstate(divide="ignore"):
+    return -20*np.log10(np.abs(S21)), -20*np.log10(np.abs(S11))
+
+def cost(topology, values, mask, R_S=50., R_L=50.):
+  """
+  total violation of the mask (dB) for each design; 0 meets the mask
+  """
+  loss, return_loss = response(topology, values, mask.freqs, R_S, R_L)
+  return mask.excess(loss, return_loss).sum(axis=1)
+
+def _cost_task(task):
+  """
+  process pool task
+  """
+  return cost(*task)
+
+def optimize(topology, bounds, mask, R_S=50., R_L=50., population=60,
+             generations=300, processes=None, keep=10, seed=None,
+             weight=0.7, crossover=0.9):
+  """
+  searches component values to meet a mask
+
+  Args
+  ====
+  topology    - (str or list) name in `topologies` or list of (position, part)
+  bounds      - list of (lowest, highest) value for each element
+  mask        - FilterMask instance
+  R_S, R_L    - (float) source and load resistances
+  population  - (int) number of candidate designs
+  generations - (int) largest number of generations; the search stops when
+                `keep` designs meet the mask
+  processes   - (int) evaluate in this many processes; default: in this one
+  keep        - (int) number of designs to return
+  seed        - (int) for the random number generator
+  weight      - (float) differential evolution mutation weight
+  crossover   - (float) differential evolution crossover probability
+
+  Returns
+  =======
+  list of dicts with "values", "cost" (dB), "margin" (dB, smallest in any
+  band), "passes" and "bands", the worst loss or return loss in each band as
+  (kind, worst, limit), best first
+  """
+  if isinstance(topology, str):
+    topology = topologies[topology]
+  rng = np.random.default_rng(seed)
+  low, high = np.log10(np.asarray(bounds, dtype=float)).T
+  dims = len(topology)
+  pool = ProcessPoolExecutor(processes) if processes else None
+
+  def evaluate(logs):
+    values = 10**logs
+    if pool is None:
+      return cost(topology, values, mask, R_S, R_L)
+    chunks = np.array_split(values, processes)
+    return np.concatenate(list(pool.map(_cost_task,
+                          [(topology, chunk, mask, R_S, R_L)
+                           for chunk in chunks])))
+
+  try:
+    logs = low + (high - low)*rng.random((population, dims))
+    costs = evaluate(logs)
+    for generation in range(generations):
+      if np.count_nonzero(costs == 0) >= keep:
+        break
+      # mutate with three other members, different from each other
+      picks = np.argsort(rng.random((population, population)), axis=1)
+      picks = np.where(picks == np.arange(population)[:,np.newaxis],
+                       picks[:,[3]], picks)[:,:3]
+      mutant = logs[picks[:,0]] + weight*(logs[picks[:,1]] - logs[picks[:,2]])
+      cross = rng.random((population, dims)) < crossover
+      cross[np.arange(population), rng.integers(dims, size=population)] = True
+      trial = np.clip(np.where(cross, mutant, logs), low, high)
+      trial_costs = evaluate(trial)
+      better = trial_costs <= costs
+      logs[better] = trial[better]
+      costs[better] = trial_costs[better]
+    logger.debug("optimize: best cost %f", costs.min())
+  finally:
+    if pool is not None:
+      pool.shutdown()
+  # distinct designs, ranked by cost and then by margin
+  values = 10**logs
+  _, first = np.unique(np.round(logs, 6), axis=0, return_index=True)
+  values = values[first]
+  loss, return_loss = response(topology, values, mask.freqs, R_S, R_L)
+  excess = mask.excess(loss, return_loss).sum(axis=1)
+  worst = np.empty((len(values), len(mask.bands)))
+  margin = np.empty(worst.shape)
+  for index, (kind, band, limit) in enumerate(mask.bands):
+    if kind == "pass":
+      worst[:,index] = loss[:,band].max(axis=1)
+      margin[:,index] = limit - worst[:,index]
+    elif kind == "stop":
+      worst[:,index] = loss[:,band].min(axis=1)
+      margin[:,index] = worst[:,index] - limit
+    else:
+      worst[:,index] = return_loss[:,band].min(axis=1)
+      margin[:,index] = worst[:,index] - limit
+  margin = margin.min(axis=1)
+  designs = []
+  for index in np.lexsort((-margin, excess))[:keep]:
+    designs.append({"values": values[index].tolist(),
+                    "cost": float(excess[index]),
+                    "margin": float(margin[index]),
+                    "passes": bool(excess[index] == 0),
+                    "bands": [(kind, float(worst[index,column]), limit)
+                              for column, (kind, band, limit)
+                              in enumerate(mask.bands)]})
+  return designs
@@ -6,6 +6,7 @@ Amplitude and phase are plotted separately, left and right
 from pylab import *
 from matplotlib.ticker import NullFormatter, ScalarFormatter
 
+from ..cache import response_cache
 from ..filters import V_lopass, V_bandpass, V_hipass
 
 Cmin=1e-20; Cmax=1e+20; Lmin=1e-20; Lmax=1e+20
@@ -89,12 +90,13 @@ def plot_filter(V, R_S, C, L, R_L, f, V_filt, Z_filt):
 
 def plot_output(ax, V, R_S, C, L, R_L, f, color, label, V_filt, Z_filt):
   """
+  plots one case; responses come from the cache when they are redrawn
   """
-  expons = expon(V_filt(V, R_S, C, L, R_L, f))
+  expons = expon(response_cache.call(V_filt, V, R_S, C, L, R_L, f))
   ax[0,0].loglog(  f/1e6, expons[0], "-", color=color, label=label)
   ax[0,1].semilogx(f/1e6, expons[1]*180/pi, "--", color=color)
   
-  Zexpon = expon(Z_filt(C, L, R_L, f))
+  Zexpon = expon(response_cache.call(Z_filt, C, L, R_L, f))
   ax[1,0].loglog(  f/1e6, Zexpon[0], "-", color=color, label=label)
   ax[1,1].semilogx(f/1e6, Zexpon[1]*180/pi, "--", color=color)
 
@@ -5,9 +5,9 @@ support for impedance matching using a Smith Chart
 """
 import logging
 from math import atan2, cos, degrees, pi, sin, tan
+import numpy as np
 
 from Electronics.circuits.filters import reactance_to_component, Xcap, Xind
-import Math.geometry as G
 
 logger = logging.getLogger(__name__)
 
@@ -83,10 +83,10 @@ def load_circles(gamma):
   
   result = {"R load": gamma}
   yL = norm_admittance(gamma)
-  print("compute_circle: yL =", yL)
+  logger.debug("load_circles: yL = %s", yL)
   gL,bL = yL.real, yL.imag
   zL = norm_impedance(gamma)
-  print("compute_circle: zL =", zL)
+  logger.debug("load_circles: zL = %s", zL)
   rL,xL = zL.real, zL.imag
   if abs(gamma - (+0.5+0j)) <= 0.5:
     # inside the r=1 circle; need constant g circle
@@ -100,6 +100,75 @@ def load_circles(gamma):
     result["r"] = {"circle": compute_circle(+1, gamma)}
   return result
   
+def match_L_network(ZL, f, Z0=50.):
+  """
+  Solves for L-circuit matching networks in closed form
+
+  This does what `matching_network` does with the Smith chart, for arrays of
+  loads and frequencies at once.  With the normalized load zL = r + ix and
+  yL = g + ib::
+
+    gamma: a series reactance takes zL to r + iX on the g=1 circle, where
+           X = +/-sqrt(r(1-r)), and a parallel susceptance X/r cancels the
+           remaining susceptance -X/r.  Possible if r <= 1.
+    fu:    a parallel susceptance takes yL to g + iB on the r=1 circle, where
+           B = +/-sqrt(g(1-g)), and a series reactance B/g cancels the
+           remaining reactance -B/g.  Possible if g <= 1.
+
+  Args
+  ====
+    ZL - (complex or nparray) load impedances in ohms
+    f  - (float or nparray) frequencies in Hz, broadcast against ZL
+    Z0 - (float) input or transmission line impedance in ohms
+
+  Returns
+  =======
+  dict keyed by "gamma" and "fu", each a dict of arrays with shape
+  broadcast(ZL, f).shape + (2,), one column for each solution::
+
+    "series", "parallel" - reactances (ohms) of the two components; an
+                           infinite parallel reactance means no component
+    "series value", "series unit", "parallel value", "parallel unit"
+                         - component values and units ('F' or 'H')
+    "valid"              - whether the solution exists; if not the values
+                           are NaN
+  """
+  ZL, f = np.broadcast_arrays(np.asarray(ZL, dtype=complex),
+                              np.asarray(f, dtype=float))
+  zL = ZL/Z0
+  yL = 1/zL
+  sign = np.array([1., -1.])
+  result = {}
+  with np.errstate(divide="ignore", invalid="ignore"):
+    # gamma circuit
+    r, x = zL.real[...,np.newaxis], zL.imag[...,np.newaxis]
+    X = sign*np.sqrt(r*(1 - r))
+    series = Z0*(X - x)
+    parallel = -Z0*r/X
+    result["gamma"] = _L_solution(series, parallel, r <= 1, f)
+    # fu circuit
+    g, b = yL.real[...,np.newaxis], yL.imag[...,np.newaxis]
+    B = sign*np.sqrt(g*(1 - g))
+    parallel = -Z0/(B - b)
+    series = Z0*B/g
+    result["fu"] = _L_solution(series, parallel, g <= 1, f)
+  return result
+
+def _L_solution(series, parallel, valid, f):
+  """
+  component values for the reactances of one L-network type
+  """
+  valid = np.broadcast_to(valid, series.shape)
+  series = np.where(valid, series, np.nan)
+  parallel = np.where(valid, parallel, np.nan)
+  f = f[...,np.newaxis]
+  ser_value, ser_unit = reactance_to_component(series, f)
+  par_value, par_unit = reactance_to_component(parallel, f)
+  return {"series": series, "parallel": parallel,
+          "series value": ser_value, "series unit": ser_unit,
+          "parallel value": par_value, "parallel unit": par_unit,
+          "valid": valid}
+
 def matching_network(ZL, f, Z0=50):
   """
   Solves for L-circuit matching networks using the Smith chart
@@ -127,6 +196,9 @@ def matching_network(ZL, f, Z0=50):
   Greek capital Gamma.)  The circuit type is "fu" if the first component is
   parallel to the load, and the second component feeds that pair. (The circuit
   looks like a Katakana Hu, pronounced "fu".)
+
+  The intersections of the load circle with the r=1 or g=1 circle are
+  computed in closed form by `match_L_network`.
   """
   netdata = {}
   zL = ZL/Z0
@@ -140,73 +212,47 @@ def matching_network(ZL, f, Z0=50):
   # compute constant load circle center and radius
   LCs = load_circles(gamma)
   logger.debug("matching_network: LCs: %s", LCs)
+  solutions = match_L_network(ZL, f, Z0=Z0)
   for key in LCs.keys():
     netdata[key] = LCs[key]
     if key == "R load":
       continue
-    circle_ctr, circle_radius = LCs[key]["circle"]
-    const_circle = G.Circle(circle_radius, center=(circle_ctr.real, 0))
-    if key == "r": # circle through load is constant `r`
-      # find the intersection with the y=1+ib circle
-      intersects = const_circle.intersect(G.Circle(0.5, center=(-0.5, 0)))
-    elif key == "g": # circle through load is constant `g`
-      # find the intersection with the z=1+ix circle
-      intersects = const_circle.intersect(G.Circle(0.5, center=( 0.5, 0)))
-    netdata[key]['intersects'] = intersects
-    logger.debug("matching_network: intersects at gamma = %s", intersects)
-    for intersect in intersects:
-      index = intersects.index(intersect)
+    solution = solutions["gamma" if key == "r" else "fu"]
+    intersects = []
+    for index in range(2):
       netdata[key][index] = {}
-      gammaX = complex(*(intersect))
-      admitX = norm_admittance(gammaX)
-      logger.debug("matching_network: intersect at y = %s", admitX)
-      impedX = norm_impedance(gammaX)
-      logger.debug("matching_network: intersect at y = %s", impedX)
-      
-      # impedance or admittance of the intersection
       if key == "g":
-        # load is on a `g=1` circle 
-        # a move to a specific intersection has the opposite sign in `z`-space
-        # and `y`-space
+        # load is on a `g=1` circle; the intersection is on the r=1 circle
+        delta_b = float(-Z0/solution["parallel"][index])
+        admitX = complex(yL.real, yL.imag + delta_b)
         netdata[key][index]['y'] = admitX
-        b = admitX.imag
-        delta_b = -(b - yL.imag) # yL is the load susceptance
-        logger.debug("additional norm. susceptance: %8.3f", delta_b)
-        netdata[key][index]['Delta b'] = -delta_b
+        netdata[key][index]['Delta b'] = delta_b
         # this is a "fu" circuit; component in parallel with load
-        # shift is delta_b
-        Zpar = reactance_to_component(Z0/delta_b, f)
-        netdata[key][index]['par'] = Zpar
+        netdata[key][index]['par'] = (float(solution["parallel value"][index]),
+                                      str(solution["parallel unit"][index]))
+        # reactance remaining at the intersection
+        netdata[key][index]['Delta x'] = float(-solution["series"][index]/Z0)
         # we need to remove the remaining reactance
-        x = -impedX.imag
-        logger.debug(
-               "matching_network: remaining reactance or susceptance: %8.3f", x)
-        netdata[key][index]['Delta x'] = -x
-        # this is a "fu" circuit; shift is delta_x
-        Zser = reactance_to_component(Z0*x, f)
-        netdata[key][index]['ser'] = Zser
-      elif key == "r":
-        # load is on an `r=1` circle
+        netdata[key][index]['ser'] = (float(solution["series value"][index]),
+                                      str(solution["series unit"][index]))
+        gammaX = (1 - admitX)/(1 + admitX)
+      else:
+        # load is on an `r=1` circle; the intersection is on the g=1 circle
+        delta_x = float(solution["series"][index]/Z0)
+        impedX = complex(zL.real, zL.imag + delta_x)
         netdata[key][index]['z'] = impedX
-        x = impedX.imag
-        delta_x =   x - zL.imag # zL is the load reactance
-        logger.debug("additional norm. reactance: %8.3f", delta_x)
         netdata[key][index]['Delta x'] = delta_x
         # this is a "gamma" circuit; component in series with load
-        # shift is delta_x
-        Zser = reactance_to_component(Z0*delta_x, f)
-        netdata[key][index]['ser'] = Zser
-        # we need to remove the remaining reactance
-        b = admitX.imag
-        logger.debug(
-                 "matching_network: remaining reactance or reactance: %8.3f", b)
-        netdata[key][index]['Delta b'] = b
-        # this is a gamma circuit; shift is delta_b
-        Zpar = reactance_to_component(Z0/b, f)
-        netdata[key][index]['par'] = Zpar
-      else:
-        logger.error("matching_network: invalid key: %s", key)
-        continue      
+        netdata[key][index]['ser'] = (float(solution["series value"][index]),
+                                      str(solution["series unit"][index]))
+        # we need to remove the remaining susceptance
+        netdata[key][index]['Delta b'] = float(Z0/solution["parallel"][index])
+        netdata[key][index]['par'] = (float(solution["parallel value"][index]),
+                                      str(solution["parallel unit"][index]))
+        gammaX = (impedX - 1)/(impedX + 1)
+      intersects.append((gammaX.real, gammaX.imag))
+    netdata[key]['intersects'] = intersects
+    logger.debug("matching_network: intersects at gamma = %s", intersects)
   return netdata
 
 def matched_impedance(ZL, circ_type, parallel, series, f):
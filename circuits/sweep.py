@@ -0,0 +1,84 @@
+"""
+evaluates circuit responses over grids of component values and frequencies
+
+The functions in `filters` (and anything else which broadcasts its
+arguments) can be swept over component values, e.g.::
+
+  out = sweep(V_lopass, f, V=1, R_S=50, C=Cs, L=Ls, R_L=50)
+
+gives an array with shape (len(Cs), len(Ls), len(f)).  Array arguments are
+the axes of the grid, in the order given; scalars are fixed.  A grid of
+100 C x 100 L x 10k f has 10^8 complex points, more than should be held in
+temporary arrays at once, so the grid is evaluated in blocks which fit in
+`max_bytes` and each block is written into the output array.  With
+`reduce=np.abs` and `dtype=float` the output is half the size.
+"""
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def grid_shape(f, params):
+  """
+  shape of the output for a set of parameters
+
+  Args
+  ====
+  f      - (float or nparray) frequencies
+  params - (dict) parameter values; arrays are grid axes
+  """
+  axes = [np.size(value) for value in params.values() if np.ndim(value) > 0]
+  return tuple(axes) + (np.size(f),)
+
+def sweep(func, f, out=None, dtype=complex, reduce=None,
+          max_bytes=64*2**20, temporaries=8, **params):
+  """
+  evaluates `func(f=f, **params)` over a grid of parameter values
+
+  Args
+  ====
+  func        - (function) response function taking keyword arguments
+  f           - (float or nparray) frequencies in Hz
+  out         - (nparray) output array of the right shape; default: new
+  dtype       - (type) of the output array, if a new one is made
+  reduce      - (function) applied to each block before it is stored, e.g.
+                `np.abs`
+  max_bytes   - (int) memory allowed for the temporary arrays of a block
+  temporaries - (int) number of temporary arrays `func` makes per point
+  params      - keyword arguments for `func`; 1-D arrays are grid axes
+
+  Returns
+  =======
+  nparray with shape (len(axis 1), len(axis 2), ..., len(f))
+  """
+  f = np.atleast_1d(np.asarray(f, dtype=float))
+  names = [name for name in params if np.ndim(params[name]) > 0]
+  shape = grid_shape(f, params)
+  if out is None:
+    out = np.empty(shape, dtype=dtype)
+  elif out.shape != shape:
+    raise ValueError("output shape %s should be %s" % (out.shape, shape))
+  # flattened (parameter points, frequencies) view of the output
+  flat = out.reshape(-1, len(f))
+  if not np.shares_memory(flat, out):
+    raise ValueError("output array must be contiguous")
+  axes = np.unravel_index(np.arange(flat.shape[0]), shape[:-1])
+  values = dict((name, np.asarray(params[name]).ravel()[index])
+                for name, index in zip(names, axes))
+  # block size: rows of parameter points by columns of frequencies
+  point_bytes = temporaries*np.dtype(complex).itemsize
+  points = max(1, max_bytes//point_bytes)
+  cols = min(len(f), points)
+  rows = max(1, points//cols)
+  logger.debug("sweep: %s points in blocks of %d x %d", shape, rows, cols)
+  kwargs = dict(params)
+  for row in range(0, flat.shape[0], rows):
+    for name in names:
+      kwargs[name] = values[name][row:row+rows, np.newaxis]
+    for col in range(0, len(f), cols):
+      kwargs["f"] = f[np.newaxis, col:col+cols]
+      result = func(**kwargs)
+      if reduce is not None:
+        result = reduce(result)
+      flat[row:row+rows, col:col+cols] = result
+  return out
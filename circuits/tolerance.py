@@ -0,0 +1,161 @@
+"""
+Monte Carlo tolerance analysis of filters and matching networks
+
+Component values are drawn within their tolerances and a response function
+is evaluated for all the draws at once, broadcast as (trials x frequencies)::
+
+  result = monte_carlo(V_lopass, f,
+                       nominal={"V": 1, "R_S": 50, "C": 1e-9, "L": 1e-6,
+                                "R_L": 50},
+                       tolerance={"C": 0.10, "L": 0.05},
+                       spec=band_spec(1e5, 1e6, low=0.45), trials=100000)
+
+A matching network from `smith` can be analysed with a wrapper::
+
+  def Zin(Cp, Ls, f):
+    return matched_impedance(ZL, "r", (Cp, "F"), (Ls, "H"), f)
+
+The spec is checked for every trial to give the yield.  Percentile envelopes
+of the response (e.g. |V| or |Z|) are computed from the first
+`envelope_trials` draws, which are a random sample of all of them, so memory
+does not grow with the number of trials.  Trials are evaluated in chunks,
+across a pool of processes if requested (the function must then be defined at
+module level so it can be sent to the processes).
+"""
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def draw(nominal, tolerance, trials, distribution="uniform", rng=None):
+  """
+  random component values
+
+  Args
+  ====
+  nominal      - (float) nominal value
+  tolerance    - (float) fractional tolerance, e.g. 0.05 for 5%
+  trials       - (int) number of values
+  distribution - (str) "uniform" within the tolerance, or "normal" with the
+                 tolerance as three standard deviations
+  rng          - (numpy.random.Generator)
+  """
+  rng = np.random.default_rng() if rng is None else rng
+  if distribution == "uniform":
+    deviation = rng.uniform(-tolerance, tolerance, trials)
+  elif distribution == "normal":
+    deviation = rng.normal(0, tolerance/3., trials)
+  else:
+    raise ValueError("unknown distribution %s" % distribution)
+  return nominal*(1 + deviation)
+
+def band_spec(f1, f2, low=None, high=None):
+  """
+  spec requiring the response to be within limits between f1 and f2
+
+  Returns
+  =======
+  function of (response, f) giving True for each trial which passes
+  """
+  return partial(_band_check, f1, f2, low, high)
+
+def _band_check(f1, f2, low, high, response, f):
+  """
+  the function made by band_spec(), at module level so processes can use it
+  """
+  band = (f >= f1) & (f <= f2)
+  passes = np.ones(len(response), dtype=bool)
+  if low is not None:
+    passes &= np.all(response[:,band] >= low, axis=1)
+  if high is not None:
+    passes &= np.all(response[:,band] <= high, axis=1)
+  return passes
+
+def _evaluate(func, f, nominal, values, quantity, spec):
+  """
+  responses of a chunk of trials, and which pass the spec
+  """
+  kwargs = dict(nominal)
+  for name in values:
+    kwargs[name] = values[name][:,np.newaxis]
+  size = len(next(iter(values.values())))
+  response = quantity(func(f=f[np.newaxis,:], **kwargs))
+  response = np.broadcast_to(response, (size, len(f)))
+  passes = spec(response, f) if spec else np.ones(len(response), dtype=bool)
+  return response, passes
+
+def _evaluate_task(task):
+  """
+  process pool task; returns only what is needed
+  """
+  keep = task[-1]
+  response, passes = _evaluate(*task[:-1])
+  return response[:keep], np.count_nonzero(passes)
+
+def monte_carlo(func, f, nominal, tolerance, trials=10000, spec=None,
+                quantity=np.abs, distribution="uniform",
+                percentiles=(1, 5, 50, 95, 99), envelope_trials=10000,
+                chunk=2000, processes=None, seed=None):
+  """
+  yield and response envelopes for toleranced components
+
+  Args
+  ====
+  func            - (function) response, called with keyword arguments and f
+  f               - (nparray) frequencies in Hz
+  nominal         - (dict) nominal values of all of the arguments of func
+  tolerance       - (dict) fractional tolerance of the varied arguments
+  trials          - (int) number of trials
+  spec            - (function) of (response, f) giving True for the trials
+                    which pass; see band_spec()
+  quantity        - (function) applied to the response, e.g. np.abs
+  distribution    - (str) "uniform" or "normal"; see draw()
+  percentiles     - (list of float) envelopes to compute
+  envelope_trials - (int) number of trials used for the envelopes
+  chunk           - (int) trials evaluated together
+  processes       - (int) number of processes; default: evaluate here
+  seed            - (int) for the random number generator
+
+  Returns
+  =======
+  dict with "trials", "passed", "yield", "yield_error" (standard error),
+  "nominal" (response) and "percentiles" (dict of arrays over f)
+  """
+  f = np.atleast_1d(np.asarray(f, dtype=float))
+  rng = np.random.default_rng(seed)
+  tasks = []
+  for start in range(0, trials, chunk):
+    size = min(chunk, trials - start)
+    values = dict((name, draw(nominal[name], tolerance[name], size,
+                              distribution, rng))
+                  for name in sorted(tolerance))
+    keep = max(0, min(size, envelope_trials - start))
+    tasks.append((func, f, nominal, values, quantity, spec, keep))
+  if processes:
+    with ProcessPoolExecutor(processes) as pool:
+      results = list(pool.map(_evaluate_task, tasks))
+  else:
+    results = map(_evaluate_task, tasks)
+  envelope = np.empty((min(trials, envelope_trials), len(f)))
+  passed = 0
+  row = 0
+  for response, count in results:
+    envelope[row:row+len(response)] = response
+    row += len(response)
+    passed += count
+  nominal_response = _evaluate(func, f, nominal,
+                               dict((name, np.array([nominal[name]]))
+                                    for name in tolerance),
+                               quantity, None)[0][0]
+  fraction = passed/float(trials)
+  logger.debug("monte_carlo: %d of %d trials pass", passed, trials)
+  return {"trials": trials,
+          "passed": passed,
+          "yield": fraction,
+          "yield_error": np.sqrt(fraction*(1 - fraction)/trials),
+          "nominal": nominal_response,
+          "percentiles": dict(zip(percentiles,
+                                  np.percentile(envelope, percentiles,
+                                                axis=0)))}
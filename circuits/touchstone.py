@@ -0,0 +1,231 @@
+"""
+reads Touchstone (.s1p, .s2p, ... .snp) S-parameter files
+
+Measured components and amplifiers can then be used with the ideal parts in
+`filters`, `network` and `smith`::
+
+  net = read_touchstone("cap.s1p")
+  ZL = net.impedance(f)                     # load for smith functions
+  elements = [("shunt", "Z", net.impedance)]  # element for network.cascade
+
+  amp = read_touchstone("amp.s2p")
+  elements = [("twoport", amp.abcd), ("series", "L", 1e-8)]
+
+The measured data are interpolated onto the analysis frequencies.
+
+Files are read one line at a time into a compact buffer so very large files
+do not make a list of Python floats.  With `mmap=True` the data are also saved
+next to the file as `<file>.npy` (or in another file given as `cache`), which
+later reads memory-map instead of parsing the file again.  If the cache file
+cannot be written, e.g. in a read-only directory, the data are kept in memory.
+
+Notes
+=====
+
+The option line is::
+
+  # <Hz|kHz|MHz|GHz> S <MA|DB|RI> R <impedance>
+
+with defaults `# GHz S MA R 50`.  Each frequency has 2 n^2 numbers after it,
+which may continue over several lines.  Two-port files give them in the
+order S11 S21 S12 S22; others row by row.  Noise data after the S-parameters
+of a two-port file (where the frequency starts again) are ignored.
+"""
+import logging
+import os.path
+from array import array
+import numpy as np
+
+from Electronics.circuits.network import s_to_abcd
+
+logger = logging.getLogger(__name__)
+
+units = {"HZ": 1., "KHZ": 1e3, "MHZ": 1e6, "GHZ": 1e9}
+
+class TouchstoneNetwork(object):
+  """
+  measured S-parameters of an n-port network
+
+  Attributes
+  ==========
+  freqs - (nparray) frequencies in Hz, ascending
+  S     - (complex nparray) S-parameters, shape (len(freqs), ports, ports)
+  Z0    - (float) reference impedance
+  ports - (int) number of ports
+  """
+  def __init__(self, freqs, S, Z0=50., filename=None):
+    self.freqs = freqs
+    self.S = S
+    self.Z0 = Z0
+    self.ports = S.shape[1]
+    self.filename = filename
+
+  def interpolate(self, f):
+    """
+    S-parameters at frequencies `f`
+
+    Magnitude and unwrapped phase are interpolated linearly, which follows
+    the phase of a delay better than interpolating real and imaginary parts.
+
+    Returns
+    =======
+    complex nparray with shape f.shape + (ports, ports)
+    """
+    f = np.asarray(f, dtype=float)
+    if np.any((f < self.freqs[0]) | (f > self.freqs[-1])):
+      raise ValueError("A value in x_new is out of the interpolation range.")
+    result = np.empty(f.shape + (self.ports, self.ports), dtype=complex)
+    for row in range(self.ports):
+      for column in range(self.ports):
+        # one parameter at a time so a memory-mapped S is not copied whole
+        S = self.S[:,row,column]
+        mag = np.interp(f, self.freqs, np.abs(S))
+        phase = np.interp(f, self.freqs, np.unwrap(np.angle(S)))
+        result[...,row,column] = mag*np.exp(1j*phase)
+    return result
+
+  def impedance(self, f):
+    """
+    impedance of a one-port at frequencies `f`
+    """
+    if self.ports != 1:
+      raise ValueError("impedance needs a one-port network")
+    S11 = self.interpolate(f)[...,0,0]
+    return self.Z0*(1 + S11)/(1 - S11)
+
+  def abcd(self, f):
+    """
+    ABCD matrices of a two-port at frequencies `f`; see `network`
+    """
+    if self.ports != 2:
+      raise ValueError("ABCD matrices need a two-port network")
+    return s_to_abcd(self.interpolate(f), Z0=self.Z0)
+
+
+def read_touchstone(filename, ports=None, mmap=False, cache=None):
+  """
+  reads a Touchstone file
+
+  Args
+  ====
+  filename - (str) name of the file
+  ports    - (int) number of ports; default: from the extension
+  mmap     - (bool) memory-map a cached copy of the data
+  cache    - (str) name of the cached copy; default: `<filename>.npy`
+
+  Returns
+  =======
+  TouchstoneNetwork instance
+  """
+  if ports is None:
+    ext = os.path.splitext(filename)[1].lower()
+    if not (ext.startswith(".s") and ext.endswith("p") and ext[2:-1].isdigit()):
+      raise ValueError("cannot tell the number of ports of %s" % filename)
+    ports = int(ext[2:-1])
+  if cache is None:
+    cache = filename+".npy"
+  if mmap and os.path.exists(cache) and \
+                         os.path.getmtime(cache) >= os.path.getmtime(filename):
+    options = _read_options(filename)
+    data = np.load(cache, mmap_mode="r")
+    logger.debug("read_touchstone: mapped %s", cache)
+  else:
+    options, values = _parse(filename, ports)
+    data = _to_complex(values, ports, options["format"])
+    if mmap:
+      try:
+        np.save(cache, data)
+      except OSError as details:
+        logger.warning("read_touchstone: cannot cache %s: %s", filename,
+                       details)
+      else:
+        data = np.load(cache, mmap_mode="r")
+  freqs = data[:,0].real*options["unit"]
+  S = data[:,1:].reshape(-1, ports, ports)
+  if ports == 2:
+    # two-port data are S11 S21 S12 S22
+    S = S.swapaxes(1, 2)
+  return TouchstoneNetwork(freqs, S, Z0=options["Z0"], filename=filename)
+
+def _options(line):
+  """
+  settings from the option line
+  """
+  options = {"unit": 1e9, "parameter": "S", "format": "MA", "Z0": 50.}
+  words = line[1:].split("!")[0].upper().split()
+  index = 0
+  while index < len(words):
+    word = words[index]
+    if word in units:
+      options["unit"] = units[word]
+    elif word in ("MA", "DB", "RI"):
+      options["format"] = word
+    elif word == "R":
+      index += 1
+      options["Z0"] = float(words[index])
+    elif word in ("S", "Y", "Z", "G", "H"):
+      options["parameter"] = word
+    index += 1
+  if options["parameter"] != "S":
+    raise ValueError("only S-parameter files are supported")
+  return options
+
+def _read_options(filename):
+  """
+  settings from a file, without reading the data
+  """
+  with open(filename) as fd:
+    for line in fd:
+      if line.startswith("#"):
+        return _options(line)
+      if line.strip() and not line.lstrip().startswith("!"):
+        break
+  return _options("#")
+
+def _parse(filename, ports):
+  """
+  option settings and the numbers of a Touchstone file
+
+  Returns
+  =======
+  (dict, nparray) - options and the values with one row per frequency
+  """
+  options = _options("#")
+  width = 1 + 2*ports**2
+  values = array("d")
+  last_freq = None
+  with open(filename) as fd:
+    for line in fd:
+      line = line.split("!")[0].strip()
+      if not line:
+        continue
+      if line.startswith("#"):
+        options = _options(line)
+        continue
+      numbers = line.split()
+      if len(values) % width == 0:
+        # the start of a frequency
+        freq = float(numbers[0])
+        if last_freq is not None and freq <= last_freq:
+          # noise parameters follow
+          break
+        last_freq = freq
+      values.extend(float(number) for number in numbers)
+  if len(values) % width:
+    raise ValueError("%s: incomplete data for %d ports" % (filename, ports))
+  return options, np.frombuffer(values, dtype=float).reshape(-1, width)
+
+def _to_complex(values, ports, fmt):
+  """
+  frequency and complex parameters in one complex array, one row per frequency
+  """
+  data = np.empty((len(values), 1 + ports**2), dtype=complex)
+  data[:,0] = values[:,0]
+  first = values[:,1::2]
+  second = values[:,2::2]
+  if fmt == "RI":
+    data[:,1:] = first + 1j*second
+  else:
+    mag = 10**(first/20.) if fmt == "DB" else first
+    data[:,1:] = mag*np.exp(1j*np.radians(second))
+  return data